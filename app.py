@@ -1,20 +1,91 @@
+import atexit
+import cProfile
+import gzip
+import hashlib
+import heapq
+import json
+import math
+import mimetypes
+import mmap
 import os
+import re
 import shutil
-import zipfile
-from collections import deque
-
-import patoolib
-from lxml import etree
-from functools import partial
-from flask import Flask, request, jsonify, send_file
+import sys
+import threading
+import time
+import unicodedata
+import uuid
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from collections.abc import Mapping, Sequence
+from contextlib import contextmanager
+from itertools import islice
+
+from lxml import etree, html
+from flask import Flask, Response, g, request, jsonify, send_file
 from flask_cors import CORS
-from PIL import Image
-from werkzeug.exceptions import BadRequest, InternalServerError, NotFound, Conflict, HTTPException
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+from urllib.parse import urlencode
+from werkzeug.exceptions import BadRequest, InternalServerError, NotFound, HTTPException, \
+    RequestEntityTooLarge
 
 app = Flask(__name__)
 CORS(app)
 
-FOLDER_IGNORE_LIST = {".DS_Store", ".git", ".venv", "__pycache__", ".idea", "venv"}
+FOLDER_IGNORE_LIST = {".DS_Store", ".git", ".venv", "__pycache__", ".idea", "venv", ".staging", ".profiles", "benchmarks",
+                      "tests"}
+MAX_LOADED_TREES = int(os.environ.get("MAX_LOADED_TREES", 8))
+SNAPSHOT_FILE = ".tree.snapshot"
+SNAPSHOT_VERSION = 6
+GENERATION_FILE = ".tree.generation"
+SEARCH_INDEX_FILE = ".tree.search"
+SOURCES_FILE = ".tree.sources"
+SOURCES_VERSION = 2
+STATS_FILE = ".tree.stats"
+ASSETS_FILE = ".tree.assets"
+ASSETS_VERSION = 1
+STATS_VERSION = 1
+SEARCH_INDEX_VERSION = 1
+SEARCH_PAGE_SIZE = 20
+SEARCH_PREFIX_TERMS = 50
+GENERATION_CHECK_SECONDS = float(os.environ.get("GENERATION_CHECK_SECONDS", 1))
+DESCRIPTION_CACHE_SIZE = int(os.environ.get("DESCRIPTION_CACHE_SIZE", 16 * 1024 * 1024))
+IMAGE_DERIVATIVE_WIDTHS = (64, 160, 320, 640)
+VARIANTS_FOLDER = ".variants"
+RASTER_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+PRECOMPRESSED_EXTENSIONS = ('.svg', '.htm', '.html')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+CATALOG_REFRESH_SECONDS = float(os.environ.get("CATALOG_REFRESH_SECONDS", 5))
+STAGING_FOLDER = ".staging"
+JOBS_FOLDER = os.path.join(STAGING_FOLDER, "jobs")
+MAX_PATHS = int(os.environ.get("MAX_PATHS", 1000))
+MAX_SUBTREE_NODES = int(os.environ.get("MAX_SUBTREE_NODES", 5000))
+MAX_EVALUATE_CASES = int(os.environ.get("MAX_EVALUATE_CASES", 100000))
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PROFILE_REQUESTS = os.environ.get("PROFILE_REQUESTS", "").lower() in ("1", "true")
+PROFILE_FOLDER = ".profiles"
+RECENT_TREES_FILE = ".recent_trees"
+RECENT_TREES_KEPT = 32
+PRELOAD_TREES = [name.strip() for name in os.environ.get("PRELOAD_TREES", "").split(",") if name.strip()]
+PRELOAD_RECENT_TREES = int(os.environ.get("PRELOAD_RECENT_TREES", MAX_LOADED_TREES))
+PRELOAD_POPULAR_NODES = int(os.environ.get("PRELOAD_POPULAR_NODES", 200))
+ACCESS_STATS_FLUSH_SECONDS = float(os.environ.get("ACCESS_STATS_FLUSH_SECONDS", 30))
+ACCESS_LOG_SIZE = int(os.environ.get("ACCESS_LOG_SIZE", 100000))
+PREFETCH_HINTS = int(os.environ.get("PREFETCH_HINTS", 3))
 
 
 @app.errorhandler(Exception)
@@ -34,14 +105,220 @@ def bad_request(e):
     return jsonify(error="Bad request"), 400
 
 
+class Metrics:
+    """
+    Counters and latency histograms rendered in the Prometheus text format.
+    Values are kept per process, so every worker reports its own series.
+    """
+
+    HELP = {
+        'http_request_duration_seconds': ('histogram', 'Request latency by route, method and status.'),
+        'tree_stage_duration_seconds': ('histogram', 'Time spent in each processing stage.'),
+        'tree_loads_total': ('counter', 'Trees loaded into the registry, by source.'),
+        'tree_reloads_total': ('counter', 'Resident trees reloaded because their generation moved.'),
+        'tree_evictions_total': ('counter', 'Trees dropped from the registry to stay under MAX_LOADED_TREES.'),
+        'description_cache_requests_total': ('counter', 'Description lookups, by cache result.'),
+        'response_cache_requests_total': ('counter', 'Encoded payload lookups, by cache result.'),
+    }
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        bucket = bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            histogram[0][bucket] += 1
+            histogram[1] += seconds
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('tree_stage_duration_seconds', time.perf_counter() - started, stage=stage)
+
+    def render(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: (list(counts), total) for key, (counts, total) in self._histograms.items()}
+
+        lines = []
+        for name, (kind, help_text) in self.HELP.items():
+            series = counters if kind == 'counter' else histograms
+            keys = sorted(key for key in series if key[0] == name)
+            if not keys:
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key in keys:
+                labels = key[1]
+                if kind == 'counter':
+                    lines.append(f"{name}{format_labels(labels)} {series[key]}")
+                    continue
+                counts, total = series[key]
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+metrics = Metrics()
+
+
+class RequestProfiler:
+    """
+    Profiles a single request with cProfile, or with pyinstrument when that
+    is asked for and installed, and dumps the result under PROFILE_FOLDER.
+    """
+
+    def __init__(self, kind):
+        self.use_pyinstrument = kind.lower() == 'pyinstrument' and pyinstrument is not None
+        if self.use_pyinstrument:
+            self._profiler = pyinstrument.Profiler()
+            self._profiler.start()
+        else:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+    def finish(self, endpoint):
+        os.makedirs(PROFILE_FOLDER, exist_ok=True)
+        name = f"{time.strftime('%Y%m%d-%H%M%S')}-{endpoint}-{uuid.uuid4().hex[:8]}"
+        if self.use_pyinstrument:
+            self._profiler.stop()
+            path = os.path.join(PROFILE_FOLDER, f"{name}.html")
+            with open(path, 'w') as file:
+                file.write(self._profiler.output_html())
+        else:
+            self._profiler.disable()
+            path = os.path.join(PROFILE_FOLDER, f"{name}.prof")
+            self._profiler.dump_stats(path)
+        return path
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    profile = request.headers.get('X-Profile')
+    if PROFILE_REQUESTS and profile:
+        try:
+            g.profiler = RequestProfiler(profile)
+        except ValueError as e:
+            # Only one cProfile/pyinstrument session can be active at a time on newer Pythons.
+            app.logger.warning(f"Could not profile request: {str(e)}")
+
+
+@app.after_request
+def record_request(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        response.headers['X-Profile-File'] = profiler.finish(request.endpoint or 'unmatched')
+
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        metrics.observe('http_request_duration_seconds', time.perf_counter() - started,
+                        route=route, method=request.method, status=response.status_code)
+    return response
+
+
+class DescriptionCache:
+    """
+    Least recently used cache of description file contents keyed by path
+    and modification time, bounded by the total number of characters it
+    holds. An edited or re-uploaded file is read again under its new
+    mtime; the stale text ages out.
+    """
+
+    def __init__(self, max_size=DESCRIPTION_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self._texts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        try:
+            key = (path, os.stat(path).st_mtime_ns)
+        except OSError as e:
+            app.logger.warning(f"Could not read description '{path}': {str(e)}")
+            return ""
+        with self._lock:
+            text = self._texts.get(key)
+            if text is not None:
+                self._texts.move_to_end(key)
+                metrics.increment('description_cache_requests_total', result='hit')
+                return text
+
+        metrics.increment('description_cache_requests_total', result='miss')
+        try:
+            with metrics.timer('description_read'), open(path, 'r') as file:
+                text = file.read()
+        except OSError as e:
+            app.logger.warning(f"Could not read description '{path}': {str(e)}")
+            return ""
+
+        with self._lock:
+            if key not in self._texts and len(text) <= self.max_size:
+                self._texts[key] = text
+                self.size += len(text)
+                while self.size > self.max_size:
+                    _, evicted = self._texts.popitem(last=False)
+                    self.size -= len(evicted)
+        return text
+
+
+description_cache = DescriptionCache()
+
+
 class Entity:
-    def __init__(self, id, label, image="", description="", parent=None):
+    __slots__ = ('id', 'label', 'image', '_description', 'description_path', 'parent')
+
+    def __init__(self, id, label, image="", description="", parent=None, description_path=None):
         self.id = id
         self.label = label
         self.image = image
-        self.description = description
+        self._description = description
+        self.description_path = description_path
         self.parent = parent
 
+    @property
+    def description(self):
+        if self.description_path:
+            return description_cache.get(self.description_path)
+        return self._description
+
+    def to_summary_dict(self):
+        return {
+            'id': self.id,
+            'label': self.label,
+            'image': self.image
+        }
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -53,6 +330,8 @@ class Entity:
 
 
 class Link:
+    __slots__ = ('id', 'label', 'image', 'description')
+
     def __init__(self, id, label, image="", description=""):
         self.id = id
         self.label = label
@@ -67,8 +346,17 @@ class Link:
             'description': self.description
         }
 
+    def to_summary_dict(self):
+        return {
+            'id': self.id,
+            'label': self.label,
+            'image': self.image
+        }
+
 
 class Association:
+    __slots__ = ('id', 'from_id', 'to_id', 'label')
+
     def __init__(self, id, from_id, to_id, label):
         self.id = id
         self.from_id = from_id
@@ -84,6 +372,538 @@ class Association:
         }
 
 
+class CompactGraph:
+    """
+    Adjacency of a built tree in compressed sparse row form.
+
+    Nodes are numbered by their position in `node_ids`. The children of
+    node i are `child_nodes[child_offsets[i]:child_offsets[i + 1]]`, reached
+    through the links at the same positions in `link_ids`; parents are
+    stored the same way. `depths` holds each node's distance from the root,
+    or -1 when the root cannot reach it. `acyclic` is False when building
+    the graph ran into a cycle; such a graph is never used.
+    """
+    __slots__ = ('node_ids', 'node_index', 'link_ids', 'child_offsets', 'child_nodes',
+                 'parent_offsets', 'parent_nodes', 'depths', 'acyclic')
+
+    def __init__(self, node_ids, link_ids, child_offsets, child_nodes, parent_offsets, parent_nodes, depths,
+                 acyclic=True):
+        self.acyclic = acyclic
+        self.node_ids = node_ids
+        self.node_index = {node_id: index for index, node_id in enumerate(node_ids)}
+        self.link_ids = link_ids
+        self.child_offsets = child_offsets
+        self.child_nodes = child_nodes
+        self.parent_offsets = parent_offsets
+        self.parent_nodes = parent_nodes
+        self.depths = depths
+
+    @classmethod
+    def build(cls, node_ids, decision_tree, root_id):
+        node_ids = list(node_ids)
+        node_index = {node_id: index for index, node_id in enumerate(node_ids)}
+
+        link_ids, child_offsets, child_nodes = [], array('i', [0]), array('i')
+        for node_id in node_ids:
+            for link_id, child_id in decision_tree.get(node_id, {}).items():
+                link_ids.append(link_id)
+                child_nodes.append(node_index[child_id])
+            child_offsets.append(len(child_nodes))
+
+        # Parents keep the order in which they first appear in decision_tree.
+        parent_lists = [[] for _ in node_ids]
+        for parent_id, children in decision_tree.items():
+            for child_id in children.values():
+                parent_lists[node_index[child_id]].append(node_index[parent_id])
+        parent_offsets, parent_nodes = array('i', [0]), array('i')
+        for parents in parent_lists:
+            parent_nodes.extend(parents)
+            parent_offsets.append(len(parent_nodes))
+
+        # A single pass in topological order (Kahn's algorithm) both finds
+        # out whether the graph is acyclic and gives every node its shortest
+        # distance from the root: all parents of a node are done before it.
+        depths = array('i', [-1]) * len(node_ids)
+        if root_id is not None:
+            depths[node_index[root_id]] = 0
+        indegree = array('i', (parent_offsets[index + 1] - parent_offsets[index] for index in range(len(node_ids))))
+        queue = [index for index, count in enumerate(indegree) if count == 0]
+        done = 0
+        while queue:
+            index = queue.pop()
+            done += 1
+            depth = depths[index] + 1 if depths[index] >= 0 else 0
+            for child_index in child_nodes[child_offsets[index]:child_offsets[index + 1]]:
+                if depth and (depths[child_index] < 0 or depth < depths[child_index]):
+                    depths[child_index] = depth
+                indegree[child_index] -= 1
+                if not indegree[child_index]:
+                    queue.append(child_index)
+
+        return cls(node_ids, link_ids, child_offsets, child_nodes, parent_offsets, parent_nodes, depths,
+                   done == len(node_ids))
+
+    def to_snapshot(self):
+        return (self.node_ids, self.link_ids, self.child_offsets, self.child_nodes,
+                self.parent_offsets, self.parent_nodes, self.depths)
+
+
+class AdjacencyView(Mapping):
+    """
+    Read-only mapping from node id to its neighbours in a CompactGraph.
+    Child views map link id -> child id like the dict-of-dicts adjacency
+    they replace; parent views return lists of parent ids. Nodes without
+    neighbours are absent.
+    """
+
+    def __init__(self, graph, offsets, targets, link_ids=None):
+        self._graph = graph
+        self._offsets = offsets
+        self._targets = targets
+        self._link_ids = link_ids
+
+    def __getitem__(self, node_id):
+        index = self._graph.node_index[node_id]
+        start, end = self._offsets[index], self._offsets[index + 1]
+        if start == end:
+            raise KeyError(node_id)
+
+        node_ids = self._graph.node_ids
+        if self._link_ids is None:
+            return [node_ids[target] for target in self._targets[start:end]]
+        return {self._link_ids[position]: node_ids[self._targets[position]] for position in range(start, end)}
+
+    def __contains__(self, node_id):
+        index = self._graph.node_index.get(node_id)
+        return index is not None and self._offsets[index] != self._offsets[index + 1]
+
+    def __iter__(self):
+        offsets = self._offsets
+        for index, node_id in enumerate(self._graph.node_ids):
+            if offsets[index] != offsets[index + 1]:
+                yield node_id
+
+    def __len__(self):
+        offsets = self._offsets
+        return sum(1 for index in range(len(offsets) - 1) if offsets[index] != offsets[index + 1])
+
+
+class StringTable:
+    """
+    Strings stored back to back as UTF-8 in a mapped buffer, addressed by
+    index through an offsets array. Index -1 stands for None.
+    """
+
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+
+    def get(self, index):
+        if index < 0:
+            return None
+        return str(self._data[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+
+    def equals(self, index, encoded):
+        return index >= 0 and self._data[self._offsets[index]:self._offsets[index + 1]] == encoded
+
+
+class StringColumn(Sequence):
+    """
+    One string column of a fixed-width int32 record table.
+    """
+
+    def __init__(self, strings, table, width, field):
+        self._strings = strings
+        self._table = table
+        self._width = width
+        self._field = field
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        return self._strings.get(self.string_index(index))
+
+    def string_index(self, row):
+        return self._table[row * self._width + self._field]
+
+    def __len__(self):
+        return len(self._table) // self._width
+
+
+class HashIndex(Mapping):
+    """
+    Maps the strings of a StringColumn to their row numbers through an
+    open-addressing hash table stored in the artifact, so lookups need no
+    per-process dictionary.
+    """
+
+    def __init__(self, strings, column, slots):
+        self._strings = strings
+        self._column = column
+        self._slots = slots
+        self._mask = len(slots) - 1
+
+    @staticmethod
+    def build(keys):
+        size = 1
+        while size < 2 * len(keys):
+            size *= 2
+        slots = array('i', [-1]) * size
+        for row, key in enumerate(keys):
+            slot = zlib.crc32(key.encode('utf-8')) & (size - 1)
+            while slots[slot] != -1:
+                slot = (slot + 1) & (size - 1)
+            slots[slot] = row
+        return slots
+
+    def __getitem__(self, key):
+        encoded = key.encode('utf-8')
+        slot = zlib.crc32(encoded) & self._mask
+        while True:
+            row = self._slots[slot]
+            if row == -1:
+                raise KeyError(key)
+            if self._strings.equals(self._column.string_index(row), encoded):
+                return row
+            slot = (slot + 1) & self._mask
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except (KeyError, AttributeError):
+            return default
+
+    def __iter__(self):
+        return iter(self._column)
+
+    def __len__(self):
+        return len(self._column)
+
+
+class MappedRecords(Mapping):
+    """
+    Read-only id -> record mapping over a mapped record table. Records are
+    built on access and not kept, so resident memory does not grow with the
+    size of the tree.
+    """
+
+    def __init__(self, index, column, make_record):
+        self._index = index
+        self._column = column
+        self._make_record = make_record
+
+    def __getitem__(self, key):
+        return self._make_record(self._index[key])
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def get(self, key, default=None):
+        row = self._index.get(key)
+        return default if row is None else self._make_record(row)
+
+    def __iter__(self):
+        return iter(self._column)
+
+    def __len__(self):
+        return len(self._column)
+
+    def values(self):
+        return (self._make_record(row) for row in range(len(self._column)))
+
+    def items(self):
+        return ((record.id, record) for record in self.values())
+
+
+class MappedGraph:
+    """
+    CompactGraph counterpart whose arrays are views into a mapped artifact.
+    """
+
+    def __init__(self, node_ids, node_index, link_ids, child_offsets, child_nodes, parent_offsets, parent_nodes,
+                 depths):
+        self.node_ids = node_ids
+        self.node_index = node_index
+        self.link_ids = link_ids
+        self.child_offsets = child_offsets
+        self.child_nodes = child_nodes
+        self.parent_offsets = parent_offsets
+        self.parent_nodes = parent_nodes
+        self.depths = depths
+
+
+class TreeArtifact:
+    """
+    Read-only, memory-mapped form of a built EntityStore.
+
+    The file holds a JSON header followed by int32 sections: a string table,
+    fixed-width entity/link/association tables with hash indexes for id
+    lookups, and the CSR arrays of the tree's CompactGraph. Every worker
+    process maps the same file, so the operating system keeps a single copy
+    of a tree in memory however many workers attach to it.
+    """
+    MAGIC = b"DTREE\x00\x00\x01"
+    ENTITY_FIELDS = 5
+    LINK_FIELDS = 4
+    ASSOCIATION_FIELDS = 4
+
+    @classmethod
+    def write(cls, store, path, source_mtime, generation):
+        strings = {}
+
+        def string_index(value):
+            if value is None:
+                return -1
+            if value not in strings:
+                strings[value] = len(strings)
+            return strings[value]
+
+        def table(records, fields):
+            values = array('i')
+            for record in records:
+                values.extend(string_index(getattr(record, field)) for field in fields)
+            return values
+
+        entities = list(store.entities.values())
+        links = list(store.links.values())
+        associations = list(store.associations.values())
+        graph = store.graph
+        sections = {
+            'entities': table(entities, ('id', 'label', 'image', 'description_path', 'parent')),
+            'entity_index': HashIndex.build([entity.id for entity in entities]),
+            'links': table(links, ('id', 'label', 'image', 'description')),
+            'link_index': HashIndex.build([link.id for link in links]),
+            'associations': table(associations, ('id', 'from_id', 'to_id', 'label')),
+            'association_index': HashIndex.build([association.id for association in associations]),
+            'child_offsets': graph.child_offsets,
+            'child_nodes': graph.child_nodes,
+            'child_links': array('i', (string_index(link_id) for link_id in graph.link_ids)),
+            'parent_offsets': graph.parent_offsets,
+            'parent_nodes': graph.parent_nodes,
+            'depths': graph.depths,
+        }
+
+        encoded = [value.encode('utf-8') for value in strings]
+        string_offsets = array('i', [0])
+        for value in encoded:
+            string_offsets.append(string_offsets[-1] + len(value))
+        sections['string_offsets'] = string_offsets
+        blobs = {name: values.tobytes() for name, values in sections.items()}
+        blobs['strings'] = b"".join(encoded)
+
+        header = {
+            'version': SNAPSHOT_VERSION,
+            'byteorder': sys.byteorder,
+            'source_mtime': source_mtime,
+            'generation': generation,
+            'root_id': store.root_id,
+            'validation': store.validation,
+            'sections': {}
+        }
+        offset = 0
+        for name, blob in blobs.items():
+            header['sections'][name] = [offset, len(blob)]
+            offset += len(blob) + (-len(blob) % 8)
+        header_bytes = json.dumps(header).encode('utf-8')
+        base = len(cls.MAGIC) + 4 + len(header_bytes)
+        base += -base % 8
+
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(cls.MAGIC)
+            file.write(len(header_bytes).to_bytes(4, 'little'))
+            file.write(header_bytes)
+            file.write(b"\x00" * (base - file.tell()))
+            for name, blob in blobs.items():
+                file.write(blob)
+                file.write(b"\x00" * (-len(blob) % 8))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def attach(cls, path, source_mtime):
+        """
+        Maps the artifact at `path` and returns a read-only EntityStore over
+        it, or None when it is missing, malformed or older than its sources.
+        """
+        try:
+            with open(path, 'rb') as file:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        if mapped[:len(cls.MAGIC)] != cls.MAGIC:
+            return None
+        header_length = int.from_bytes(mapped[len(cls.MAGIC):len(cls.MAGIC) + 4], 'little')
+        header_start = len(cls.MAGIC) + 4
+        try:
+            header = json.loads(mapped[header_start:header_start + header_length])
+        except ValueError:
+            return None
+        if header.get('version') != SNAPSHOT_VERSION or header.get('byteorder') != sys.byteorder \
+                or header.get('source_mtime') != source_mtime:
+            return None
+
+        base = header_start + header_length
+        base += -base % 8
+        view = memoryview(mapped)
+
+        def section(name, typecode='i'):
+            offset, length = header['sections'][name]
+            data = view[base + offset:base + offset + length]
+            return data.cast(typecode) if typecode != 'B' else data
+
+        strings = StringTable(section('string_offsets'), section('strings', 'B'))
+
+        def records(table_name, index_name, width, make_record):
+            table = section(table_name)
+            ids = StringColumn(strings, table, width, 0)
+            index = HashIndex(strings, ids, section(index_name))
+
+            def make(row):
+                start = row * width
+                return make_record(*(strings.get(value) for value in table[start:start + width]))
+
+            return MappedRecords(index, ids, make), ids, index
+
+        def make_entity(entity_id, label, image, description_path, parent):
+            return Entity(entity_id, label, image, "", parent, description_path)
+
+        store = EntityStore()
+        store.entities, node_ids, node_index = records('entities', 'entity_index', cls.ENTITY_FIELDS, make_entity)
+        store.links, _, _ = records('links', 'link_index', cls.LINK_FIELDS, Link)
+        store.associations, _, _ = records('associations', 'association_index', cls.ASSOCIATION_FIELDS,
+                                           Association)
+        store.root_id = header['root_id']
+        store.validation = header['validation']
+        store.generation = header['generation']
+        store._use_graph(MappedGraph(
+            node_ids, node_index, StringColumn(strings, section('child_links'), 1, 0),
+            section('child_offsets'), section('child_nodes'), section('parent_offsets'), section('parent_nodes'),
+            section('depths')))
+        return store
+
+
+class TreeSources:
+    """
+    Content digests of the topic and association elements of a tree's XTM
+    file, each with the id it produced, as of the build with `source_mtime`.
+    Comparing them with a fresh scan of the edited file tells which
+    elements changed, so a reload only parses those.
+    """
+
+    ELEMENT_PATTERN = re.compile(rb'\s*(<(topic|association)\b(?:[^>]*/>|[^>]*>.*?</\2\s*>))', re.S)
+    KINDS = {b'topic': 'topic', b'association': 'association'}
+    WRAPPER_START = (b'<topicMap xmlns="http://www.topicmaps.org/xtm/1.0/" '
+                     b'xmlns:xlink="http://www.w3.org/1999/xlink">')
+    WRAPPER_END = b'</topicMap>'
+    MAP_START_PATTERN = re.compile(rb'\s*<topicMap\b[^>]*(?<!/)>')
+    MAP_END_PATTERN = re.compile(rb'\s*</topicMap\s*>\s*')
+    CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, source_mtime, keys):
+        self.source_mtime = source_mtime
+        self.keys = keys
+
+    @classmethod
+    def scan(cls, xml_path, known=None):
+        """
+        Splits the XTM file into (kind, digest, element bytes) triples in
+        document order, reading it a chunk at a time. The bytes are kept
+        only for elements whose digest is not in `known`, the digests of an
+        earlier build, and are None for the others. Returns None when the
+        file is not UTF-8, so elements cannot be parsed on their own, or
+        when anything but whitespace lies between the elements and the
+        <topicMap> wrapper, as in a truncated or otherwise malformed file;
+        those files need the full parser.
+        """
+        elements = []
+        with open(xml_path, 'rb') as file:
+            data = file.read(cls.CHUNK_SIZE)
+            declaration = data[:data.find(b'?>') + 2] if data.startswith(b'<?xml') else b''
+            if b'encoding' in declaration and not re.search(rb'encoding\s*=\s*["\']utf-?8', declaration, re.I):
+                return None
+
+            start = cls.MAP_START_PATTERN.match(data, len(declaration))
+            if start is None:
+                return None
+            position = start.end()
+            while True:
+                match = cls.ELEMENT_PATTERN.match(data, position)
+                if match is None:
+                    # Either the next element is cut off at the end of the
+                    # chunk or nothing but the closing wrapper is left.
+                    chunk = file.read(cls.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    data = data[position:] + chunk
+                    position = 0
+                    continue
+                source = match.group(1)
+                digest = hashlib.blake2b(source, digest_size=8).hexdigest()
+                keep = known is not None and digest not in known
+                elements.append((cls.KINDS[match.group(2)], digest, source if keep else None))
+                position = match.end()
+        if cls.MAP_END_PATTERN.fullmatch(data, position) is None:
+            return None
+        return elements
+
+    @classmethod
+    def from_parse(cls, elements, order, source_mtime):
+        """
+        Pairs a scan with the (kind, id) order the parser reported for the
+        same file. Returns None when they disagree, as they do for maps
+        using namespace prefixes. Ids produced by more than one element are
+        left out, so those elements are always parsed again.
+        """
+        if elements is None or len(elements) != len(order) \
+                or any(kind != parsed_kind for (kind, _, _), (parsed_kind, _) in zip(elements, order)):
+            return None
+        counts = {}
+        for item in order:
+            counts[item] = counts.get(item, 0) + 1
+        keys = {digest: [kind, key] for (kind, digest, _), (_, key) in zip(elements, order)
+                if counts[(kind, key)] == 1}
+        return cls(source_mtime, keys)
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, 'rb') as file:
+                data = json.loads(zlib.decompress(file.read()))
+        except (OSError, ValueError, zlib.error):
+            return None
+        if data.get('version') != SOURCES_VERSION:
+            return None
+        keys = {digest: [kind, key] for kind in cls.KINDS.values() for digest, key in data[kind].items()}
+        return cls(data['source_mtime'], keys)
+
+    def save(self, path):
+        # Stored per kind and compressed: the ids share long prefixes, and
+        # the file has one entry for every element of the map.
+        data = {'version': SOURCES_VERSION, 'source_mtime': self.source_mtime}
+        data.update({kind: {} for kind in self.KINDS.values()})
+        for digest, (kind, key) in self.keys.items():
+            data[kind][digest] = key
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(zlib.compress(json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode(), 6))
+        os.replace(temp_path, path)
+
+    def parse_element(self, source):
+        return etree.fromstring(self.WRAPPER_START + source + self.WRAPPER_END)[0]
+
+
+class TreeValidationError(ValueError):
+    def __init__(self, message, report):
+        super().__init__(message)
+        self.report = report
+
+
 class EntityStore:
     XTM_NS = "http://www.topicmaps.org/xtm/1.0/"
     XLINK_NS = "http://www.w3.org/1999/xlink"
@@ -93,135 +913,1511 @@ class EntityStore:
         self.links = {}
         self.associations = {}
         self.decision_tree = {}
-
-    def parse_xtm_file(self, file_path):
-        parser = etree.XMLParser(remove_blank_text=True)
-        tree = etree.parse(file_path, parser)
-        root = tree.getroot()
-
+        self.root_id = None
+        self.parents = {}
+        self.graph = None
+        self.validation = None
+        self.generation = None
+        self.checked_at = 0.0
+        self.response_cache = {}
+        self.assets = None
+        self.search_index = None
+        self.transitions = None
+        self.prefetch = {}
+        self.name = None
+        self.xml_path = None
+        self.source_mtime = None
+        self.images_mtime = None
+        self.rejected_sources = None
+
+    def parse_xtm_file(self, file_path, order=None):
+        """
+        Streams the XTM file, handling each topic and association as its
+        closing tag is read and discarding it afterwards, so memory stays
+        bounded by the size of one element rather than the whole map.
+        When `order` is given, a (kind, id) pair is appended to it for every
+        element, in document order.
+        """
         nsmap = {'xtm': self.XTM_NS, 'xlink': self.XLINK_NS}
-        find = partial(root.find, namespaces=nsmap)
-        findall = partial(root.findall, namespaces=nsmap)
-
-        for topic in findall('.//xtm:topic'):
-            self._parse_topic(topic, nsmap)
+        topic_tag = f'{{{self.XTM_NS}}}topic'
+        association_tag = f'{{{self.XTM_NS}}}association'
+
+        members = []
+        context = etree.iterparse(file_path, events=('end',), tag=(topic_tag, association_tag),
+                                  remove_blank_text=True, huge_tree=True)
+        for _, element in context:
+            if element.tag == topic_tag:
+                topic_id = self._parse_topic(element, nsmap)
+                if order is not None:
+                    order.append(('topic', topic_id))
+            else:
+                members.append(self._parse_association(element, nsmap))
+                if order is not None:
+                    order.append(('association', members[-1][0]))
+
+            element.clear()
+            parent = element.getparent()
+            while element.getprevious() is not None:
+                del parent[0]
+
+        self._resolve_associations(members)
+
+    @classmethod
+    def reparse(cls, previous, sources, elements):
+        """
+        Builds a store from a re-scanned XTM file (see TreeSources.scan),
+        copying every element whose digest `sources` knows from `previous`
+        and parsing only the others. Returns the store and its (kind, id)
+        parse order.
+        """
+        store = cls()
+        nsmap = {'xtm': cls.XTM_NS, 'xlink': cls.XLINK_NS}
+        members, order = [], []
+        for kind, digest, source in elements:
+            known = sources.keys.get(digest)
+            key = None
+            if known is not None and known[0] == kind:
+                if kind == 'topic':
+                    key = store._copy_topic(previous, known[1])
+                else:
+                    association = previous.associations.get(known[1])
+                    if association is not None:
+                        key = association.id
+                        members.append((association.id, association.from_id, association.to_id))
+
+            if key is None:
+                if source is None:
+                    raise KeyError(f"No source kept for {kind} {digest}")
+                element = sources.parse_element(source)
+                if kind == 'topic':
+                    key = store._parse_topic(element, nsmap)
+                else:
+                    members.append(store._parse_association(element, nsmap))
+                    key = members[-1][0]
+            order.append((kind, key))
+
+        store._resolve_associations(members)
+        return store, order
+
+    def _copy_topic(self, previous, topic_id):
+        entity = previous.entities.get(topic_id)
+        if entity is not None:
+            self.entities[entity.id] = Entity(entity.id, entity.label, entity.image,
+                                              description_path=entity.description_path)
+            return entity.id
+        link = previous.links.get(topic_id)
+        if link is not None:
+            self.links[link.id] = Link(link.id, link.label, link.image, link.description)
+            return link.id
+        return None
 
-        for association in findall('.//xtm:association'):
-            self._parse_association(association, nsmap)
+    def _resolve_associations(self, members):
+        # Linking phrases may follow the associations that use them, so labels are resolved last.
+        for link_id, from_id, to_id in members:
+            link = self.links.get(link_id)
+            self.associations[link_id] = Association(link_id, from_id, to_id, link.label if link else None)
 
     def _parse_topic(self, topic, nsmap):
-        topic_id = topic.get("id")
-        instance_of = topic.find('.//xtm:instanceOf', namespaces=nsmap)
-        topic_type = 'linkingPhrase' if instance_of is not None and \
-                                        instance_of.find('.//xtm:subjectIndicatorRef', namespaces=nsmap).get(
-                                            f'{{{self.XLINK_NS}}}href').endswith('#linkingPhrase') \
+        topic_id = sys.intern(topic.get("id"))
+        subject_ref = topic.find('xtm:instanceOf/xtm:subjectIndicatorRef', namespaces=nsmap)
+        topic_type = 'linkingPhrase' if subject_ref is not None and \
+                                        subject_ref.get(f'{{{self.XLINK_NS}}}href', '').endswith('#linkingPhrase') \
             else 'topic'
 
-        base_name = topic.findtext('.//xtm:baseNameString', namespaces=nsmap)
-        image_name, description = "", ""
+        base_name = topic.findtext('xtm:baseName/xtm:baseNameString', namespaces=nsmap)
+        image_name, description_path = "", None
 
         if topic_type == 'linkingPhrase':
-            self.links[topic_id] = Link(topic_id, base_name, image_name, description)
+            self.links[topic_id] = Link(topic_id, base_name, image_name, "")
         else:
-            for occurrence in topic.findall('.//xtm:occurrence', namespaces=nsmap):
-                resource_ref = occurrence.find('.//xtm:resourceRef', namespaces=nsmap)
-                if resource_ref is not None:
-                    file_path = resource_ref.get(f'{{{self.XLINK_NS}}}href')
-                    if file_path.startswith('file'):
-                        image_name, description = self._parse_occurrence(file_path, image_name, description)
-
-            self.entities[topic_id] = Entity(topic_id, base_name, image_name, description)
-
-    def _parse_occurrence(self, file_path, image_name, description):
+            for resource_ref in topic.iterfind('xtm:occurrence/xtm:resourceRef', namespaces=nsmap):
+                file_path = resource_ref.get(f'{{{self.XLINK_NS}}}href')
+                if file_path.startswith('file'):
+                    image_name, description_path = self._parse_occurrence(file_path, image_name, description_path)
+
+            self.entities[topic_id] = Entity(topic_id, base_name, image_name, description_path=description_path)
+        return topic_id
+
+    def _parse_occurrence(self, file_path, image_name, description_path):
+        """
+        Resolves an occurrence to an image path or a description file path.
+        Description files are only read when a description is requested.
+        """
         _, file_extension = os.path.splitext(file_path)
         folder_name, file_name = file_path.split('/./')[1].split('/')
         if file_extension.lower() in ('.png', '.jpg', '.jpeg', '.svg'):
             image_name = os.path.join(folder_name, 'images', file_name)
         elif file_extension.lower() in ('.txt'):
-            with open(os.path.join(folder_name, 'texts', file_name), 'r') as file:
-                description = file.read()
+            description_path = os.path.join(folder_name, 'texts', file_name)
         elif file_extension.lower() in ('.htm', '.html'):
-            file_name_folder = os.path.join(folder_name, 'texts', file_name)
-            if os.path.isfile(file_name_folder):
-                with open(os.path.join(folder_name, 'texts', file_name), 'r') as file:
-                    description = file.read()
-            else:
-                with open(os.path.join(folder_name, 'texts', file_name + 'l'), 'r') as file:
-                    description = file.read()
-        return image_name, description
+            description_path = os.path.join(folder_name, 'texts', file_name)
+            if not os.path.isfile(description_path):
+                description_path += 'l'
+        return image_name, description_path
 
     def _parse_association(self, association, nsmap):
-        link_id = \
-            association.find('.//xtm:instanceOf/xtm:topicRef', namespaces=nsmap).get(f'{{{self.XLINK_NS}}}href').split(
-                '#')[
-                -1]
-        members = association.findall('.//xtm:member/xtm:topicRef', namespaces=nsmap)
+        link_id = association.find('xtm:instanceOf/xtm:topicRef', namespaces=nsmap).get(
+            f'{{{self.XLINK_NS}}}href').split('#')[-1]
+        members = association.findall('xtm:member/xtm:topicRef', namespaces=nsmap)
         from_id = members[0].get(f'{{{self.XLINK_NS}}}href').split('#')[-1]
         to_id = members[1].get(f'{{{self.XLINK_NS}}}href').split('#')[-1]
 
-        self.associations[link_id] = Association(link_id, from_id, to_id, self.links[link_id].label)
+        # Interning makes every reference to an id share the topic's string.
+        link_id, from_id, to_id = sys.intern(link_id), sys.intern(from_id), sys.intern(to_id)
+
+        return link_id, from_id, to_id
 
     def build_decision_tree(self):
+        """
+        Builds and validates the adjacency. Cycles are detected by the
+        topological pass that numbers the nodes' depths (see
+        CompactGraph.build), so a valid tree is traversed only once; the
+        full validate() report is only compiled for a tree that fails.
+        """
+        self.build_adjacency()
+
+        graph = None
+        if not self._find_dangling():
+            graph = CompactGraph.build(self.entities, self.decision_tree, self.root_id)
+        if graph is None or not graph.acyclic or not self.root_id:
+            report = self.validate()
+            self.validation = report
+            if report['dangling']:
+                first = report['dangling'][0]
+                raise TreeValidationError(
+                    f"Association '{first['association']}' references missing topics: {', '.join(first['missing'])}",
+                    report)
+            if report['cycles']:
+                raise TreeValidationError(f"Circular reference detected: {' -> '.join(report['cycles'][0])}", report)
+            raise TreeValidationError("No root node found in the decision tree", report)
+
+        offsets, node_ids = graph.parent_offsets, graph.node_ids
+        self.validation = {
+            'valid': True,
+            'root_id': self.root_id,
+            'roots': [node_ids[index] for index in range(len(node_ids)) if offsets[index] == offsets[index + 1]],
+            'cycles': [],
+            'unreachable': [node_ids[index] for index, depth in enumerate(graph.depths) if depth < 0],
+            'dangling': []
+        }
+
+        for parent_id, children in self.decision_tree.items():
+            for child_id in children.values():
+                self.entities[child_id].parent = parent_id
+
+        self._use_graph(graph)
+
+    def _use_graph(self, graph):
+        self.graph = graph
+        self.decision_tree = AdjacencyView(graph, graph.child_offsets, graph.child_nodes, graph.link_ids)
+        self.parents = AdjacencyView(graph, graph.parent_offsets, graph.parent_nodes)
+
+    def build_adjacency(self):
         self.decision_tree = {}
         for assoc in self.associations.values():
             if assoc.from_id not in self.decision_tree:
                 self.decision_tree[assoc.from_id] = {}
             self.decision_tree[assoc.from_id][assoc.id] = assoc.to_id
 
-        visited = set()
+        target_nodes = {assoc.to_id for assoc in self.associations.values()}
+        self.root_id = next((entity_id for entity_id in self.entities if entity_id not in target_nodes), None)
+
+    def validate(self):
+        """
+        Checks the adjacency built by build_adjacency in linear time, without
+        recursion, and returns a report of every cycle (one per back edge),
+        every root candidate, nodes unreachable from the root and
+        associations that reference missing topics or linking phrases.
+        """
+        entities = self.entities
+        decision_tree = self.decision_tree
+        dangling = self._find_dangling()
+        cycles = self._find_cycles()
 
-        def check_circular(node_id, path):
-            if node_id in path:
-                raise ValueError(f"Circular reference detected: {' -> '.join(path + [node_id])}")
-            if node_id in visited:
-                return
-            visited.add(node_id)
-            path.append(node_id)
-            for child_id in self.decision_tree.get(node_id, {}).values():
-                check_circular(child_id, path)
-            path.pop()
+        target_nodes = {assoc.to_id for assoc in self.associations.values()}
+        roots = [entity_id for entity_id in entities if entity_id not in target_nodes]
+
+        reachable = set()
+        if self.root_id:
+            reachable.add(self.root_id)
+            queue = [self.root_id]
+            while queue:
+                children = decision_tree.get(queue.pop())
+                if children:
+                    for child_id in children.values():
+                        if child_id not in reachable and child_id in entities:
+                            reachable.add(child_id)
+                            queue.append(child_id)
 
-        root = self.find_root_node()
-        if root:
-            check_circular(root['root']['id'], [])
-        else:
-            raise ValueError("No root node found in the decision tree")
+        return {
+            'valid': not dangling and not cycles and self.root_id is not None,
+            'root_id': self.root_id,
+            'roots': roots,
+            'cycles': cycles,
+            'unreachable': [entity_id for entity_id in entities if entity_id not in reachable],
+            'dangling': dangling
+        }
 
-        for parent_id, children in self.decision_tree.items():
+    def _find_dangling(self):
+        entities = self.entities
+        dangling = []
+        for assoc in self.associations.values():
+            if assoc.from_id in entities and assoc.to_id in entities and assoc.id in self.links:
+                continue
+            missing = [topic_id for topic_id in (assoc.from_id, assoc.to_id) if topic_id not in entities]
+            if assoc.id not in self.links:
+                missing.append(assoc.id)
+            if missing:
+                dangling.append({'association': assoc.id, 'from_id': assoc.from_id, 'to_id': assoc.to_id,
+                                 'missing': missing})
+        return dangling
+
+    def _find_cycles(self):
+        """
+        Returns one cycle per back edge. Kahn's algorithm first peels off
+        every node that cannot lie on or below a cycle; only what remains is
+        walked with an iterative three-color depth-first search.
+        """
+        entities = self.entities
+        decision_tree = self.decision_tree
+        indegree = dict.fromkeys(entities, 0)
+        for children in decision_tree.values():
             for child_id in children.values():
-                self.entities[child_id].parent = parent_id
+                if child_id in indegree:
+                    indegree[child_id] += 1
+
+        queue = [entity_id for entity_id, count in indegree.items() if count == 0]
+        while queue:
+            node_id = queue.pop()
+            del indegree[node_id]
+            for child_id in decision_tree.get(node_id, {}).values():
+                if child_id in indegree:
+                    indegree[child_id] -= 1
+                    if indegree[child_id] == 0:
+                        queue.append(child_id)
+        if not indegree:
+            return []
+
+        gray, black = 1, 2
+        color = {}
+        cycles = []
+        for start_id in indegree:
+            if start_id in color:
+                continue
+            color[start_id] = gray
+            path = [start_id]
+            positions = {start_id: 0}
+            stack = [iter(decision_tree.get(start_id, {}).values())]
+            while stack:
+                child_id = next(stack[-1], None)
+                if child_id is None:
+                    node_id = path.pop()
+                    del positions[node_id]
+                    color[node_id] = black
+                    stack.pop()
+                elif child_id not in indegree:
+                    continue
+                elif child_id not in color:
+                    color[child_id] = gray
+                    positions[child_id] = len(path)
+                    path.append(child_id)
+                    stack.append(iter(decision_tree.get(child_id, {}).values()))
+                elif color[child_id] == gray:
+                    cycles.append(path[positions[child_id]:] + [child_id])
+        return cycles
 
     def find_root_node(self):
-        target_nodes = {assoc.to_id for assoc in self.associations.values()}
-        for entity_id in self.entities:
-            if entity_id not in target_nodes:
-                return create_node(entity_id)
-        return None
+        if self.root_id is None:
+            return None
+        return create_node(self, self.root_id)
+
+    def depth(self, node_id):
+        """
+        Returns the node's distance from the root, or None when unreachable.
+        """
+        depth = self.graph.depths[self.graph.node_index[node_id]]
+        return depth if depth >= 0 else None
 
     def clear_tree(self):
-        self.entities.clear()
-        self.links.clear()
-        self.associations.clear()
-        self.decision_tree.clear()
+        self.entities = {}
+        self.links = {}
+        self.associations = {}
+        self.decision_tree = {}
+        self.root_id = None
+        self.parents = {}
+        self.graph = None
+
+    def save_snapshot(self, snapshot_path, source_mtime, generation):
+        """
+        Compiles the built tree into the memory-mapped artifact at
+        `snapshot_path`. Descriptions are stored as file paths.
+        """
+        TreeArtifact.write(self, snapshot_path, source_mtime, generation)
+
+    @classmethod
+    def load_snapshot(cls, snapshot_path, source_mtime):
+        """
+        Returns a read-only store mapped from `snapshot_path`, or None when
+        the artifact is missing, unreadable or older than its sources.
+        """
+        return TreeArtifact.attach(snapshot_path, source_mtime)
+
+
+def tree_source_mtime(folder, xml_path):
+    """
+    Returns the newest modification time among the files a tree is built
+    from: its XML and the description files in its texts folder.
+    """
+    mtime = os.stat(xml_path).st_mtime_ns
+    texts_folder = os.path.join(folder, 'texts')
+    if os.path.isdir(texts_folder):
+        with os.scandir(texts_folder) as entries:
+            for entry in entries:
+                mtime = max(mtime, entry.stat().st_mtime_ns)
+    return mtime
+
+
+def tree_images_mtime(folder):
+    images_folder = os.path.join(folder, 'images')
+    return os.stat(images_folder).st_mtime_ns if os.path.isdir(images_folder) else None
+
+
+def tree_sources_signature(folder, xml_path):
+    """
+    Returns the (source mtime, images mtime) pair a store is checked
+    against, or None when the tree's files cannot be read.
+    """
+    try:
+        return tree_source_mtime(folder, xml_path), tree_images_mtime(folder)
+    except OSError:
+        return None
+
 
+class AssetIndex:
+    """
+    Content hashes of the files a tree serves through /api/images and
+    /api/tree_graph, keyed by the path clients request them with. Building
+    the index also writes gzip (and, when available, brotli) copies of SVG
+    and HTML assets into VARIANTS_FOLDER next to them. The hashes are saved
+    in the tree's folder with each file's size and mtime, so later builds
+    only read files that changed.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.hashes = {}
+        self.graphs = []
+        self._files = {}
+
+    @classmethod
+    def build(cls, folder):
+        index = cls(folder)
+        path = os.path.join(folder, ASSETS_FILE)
+        known = cls._load(path)
+        images_folder = os.path.join(folder, 'images')
+        if os.path.isdir(images_folder):
+            for entry in sorted(os.scandir(images_folder), key=lambda entry: entry.name):
+                if entry.is_file() and index._is_servable(entry.name):
+                    index._add(entry, known)
+        for entry in sorted(os.scandir(folder), key=lambda entry: entry.name):
+            if entry.is_file() and index._is_servable(entry.name) and not entry.name.endswith('.xml'):
+                index._add(entry, known)
+                index.graphs.append(entry.name)
+        if index._files != known:
+            try:
+                index._save(path)
+            except OSError as e:
+                app.logger.warning(f"Could not write asset index for tree '{folder}': {str(e)}")
+        return index
+
+    def get(self, path):
+        return self.hashes.get(path)
+
+    def find_graph(self, prefix):
+        return next((name for name in self.graphs if name.startswith(prefix)), None)
+
+    def urls(self):
+        urls = {}
+        for path, content_hash in self.hashes.items():
+            file_name = os.path.basename(path)
+            if file_name in self.graphs:
+                query = {'name': f"{self.folder}/{file_name}", 'v': content_hash}
+                urls[path] = f"/api/tree_graph?{urlencode(query)}"
+            else:
+                urls[path] = f"/api/images?{urlencode({'image': path, 'v': content_hash})}"
+        return urls
 
-entity_store = EntityStore()
+    @staticmethod
+    def _load(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        return data.get('files', {}) if data.get('version') == ASSETS_VERSION else {}
+
+    def _save(self, path):
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(json.dumps({'version': ASSETS_VERSION, 'files': self._files}, separators=(',', ':'),
+                                  ensure_ascii=False))
+        os.replace(temp_path, path)
+
+    def _is_servable(self, file_name):
+        return not file_name.startswith('.') and not file_name.endswith(('.gz', '.br', '.tmp'))
+
+    def _add(self, entry, known):
+        stat = entry.stat()
+        signature = [stat.st_size, stat.st_mtime_ns]
+        cached = known.get(entry.path)
+        if cached is not None and cached[:2] == signature:
+            content_hash = cached[2]
+        else:
+            with open(entry.path, 'rb') as file:
+                data = file.read()
+            content_hash = hashlib.blake2b(data, digest_size=16).hexdigest()
+            if entry.path.lower().endswith(PRECOMPRESSED_EXTENSIONS):
+                self._write_compressed(compressed_asset_path(entry.path, '.gz'), lambda: gzip.compress(data, 9))
+                if brotli is not None:
+                    self._write_compressed(compressed_asset_path(entry.path, '.br'), lambda: brotli.compress(data))
+        self.hashes[entry.path] = content_hash
+        self._files[entry.path] = signature + [content_hash]
+
+    def _write_compressed(self, compressed_path, compress):
+        os.makedirs(os.path.dirname(compressed_path), exist_ok=True)
+        temp_path = f"{compressed_path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(compress())
+        os.replace(temp_path, compressed_path)
+
+
+def compressed_asset_path(path, suffix):
+    folder, file_name = os.path.split(path)
+    return os.path.join(folder, VARIANTS_FOLDER, f"{file_name}{suffix}")
+
+
+class SearchIndex:
+    """
+    Inverted index over entity labels, link labels and entity descriptions,
+    read or built on a tree's first search and saved in its folder. Terms are
+    lowercased with diacritics folded away; each posting holds a document
+    number and its field-weighted, saturated term frequency, kept as two
+    lists sorted by document. Link documents point at the node the link
+    leads to.
+    """
+
+    LABEL_WEIGHT = 3.0
+    LINK_WEIGHT = 2.0
+    DESCRIPTION_WEIGHT = 1.0
+
+    def __init__(self, docs, postings):
+        self.docs = docs
+        self.postings = postings
+        self.terms = sorted(postings)
+
+    @classmethod
+    def build(cls, store):
+        docs, frequencies = [], {}
+
+        def add(text, weight):
+            counts = {}
+            for term in tokenize(text):
+                counts[term] = counts.get(term, 0) + 1
+            for term, count in counts.items():
+                term_docs = frequencies.setdefault(term, {})
+                term_docs[doc] = term_docs.get(doc, 0.0) + weight * 2.2 * count / (count + 1.2)
+
+        for entity in store.entities.values():
+            doc = len(docs)
+            docs.append(('node', entity.id, entity.id))
+            add(entity.label, cls.LABEL_WEIGHT)
+            add(read_description_text(entity), cls.DESCRIPTION_WEIGHT)
+        for link in store.links.values():
+            association = store.associations.get(link.id)
+            if association is None:
+                continue
+            doc = len(docs)
+            docs.append(('link', link.id, association.to_id))
+            add(link.label, cls.LINK_WEIGHT)
+
+        postings = {term: [list(term_docs), list(term_docs.values())] for term, term_docs in frequencies.items()}
+        return cls(docs, postings)
+
+    @classmethod
+    def load_or_build(cls, folder, store, source_mtime):
+        path = os.path.join(folder, SEARCH_INDEX_FILE)
+        index = cls.load(path, source_mtime)
+        if index is None:
+            with metrics.timer('search_index'):
+                index = cls.build(store)
+            try:
+                index.save(path, source_mtime)
+            except OSError as e:
+                app.logger.warning(f"Could not write search index for tree '{folder}': {str(e)}")
+        return index
+
+    @classmethod
+    def load(cls, path, source_mtime):
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != SEARCH_INDEX_VERSION or data.get('source_mtime') != source_mtime:
+            return None
+        return cls([tuple(doc) for doc in data['docs']], data['postings'])
+
+    def save(self, path, source_mtime):
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            # json.dumps runs the C encoder; json.dump to a file falls back to the pure Python one.
+            file.write(json.dumps({'version': SEARCH_INDEX_VERSION, 'source_mtime': source_mtime, 'docs': self.docs,
+                                   'postings': self.postings}, separators=(',', ':'), ensure_ascii=False))
+        os.replace(temp_path, path)
+
+    def search(self, query):
+        """
+        Returns the scores of the documents matching every query term, keyed
+        by document. The last term also matches as a prefix, ranked below
+        exact matches, so results follow a query as it is typed. Terms are
+        intersected rarest first, probing the longer posting lists by binary
+        search instead of scanning them.
+        """
+        tokens = tokenize(query)
+        groups = []
+        for position, token in enumerate(tokens):
+            group = []
+            for term in self._expand(token, position == len(tokens) - 1):
+                docs, weights = self.postings[term]
+                idf = math.log(1 + len(self.docs) / len(docs))
+                group.append((docs, weights, idf if term == token else idf * 0.5))
+            if not group:
+                return {}
+            groups.append(group)
+        groups.sort(key=lambda group: sum(len(docs) for docs, _, _ in group))
+
+        scores = {}
+        for docs, weights, idf in groups[0] if groups else ():
+            for doc, weight in zip(docs, weights):
+                if weight * idf > scores.get(doc, 0.0):
+                    scores[doc] = weight * idf
+        for group in groups[1:]:
+            matched = {}
+            for docs, weights, idf in group:
+                if len(docs) <= len(scores) * 16:
+                    for doc, weight in zip(docs, weights):
+                        if doc in scores and weight * idf > matched.get(doc, 0.0):
+                            matched[doc] = weight * idf
+                    continue
+                for doc in scores:
+                    i = bisect_left(docs, doc)
+                    if i < len(docs) and docs[i] == doc and weights[i] * idf > matched.get(doc, 0.0):
+                        matched[doc] = weights[i] * idf
+            scores = {doc: scores[doc] + score for doc, score in matched.items()}
+            if not scores:
+                break
+        return scores
+
+    def _expand(self, token, prefix):
+        if not prefix:
+            return [token] if token in self.postings else []
+        start = bisect_left(self.terms, token)
+        return [term for term in self.terms[start:start + SEARCH_PREFIX_TERMS] if term.startswith(token)]
+
+
+def tokenize(text):
+    if not text:
+        return []
+    if text.isascii():
+        return re.findall(r"\w+", text.lower())
+    folded = unicodedata.normalize('NFKD', text.lower())
+    return re.findall(r"\w+", "".join(char for char in folded if not unicodedata.combining(char)))
+
+
+def read_description_text(entity):
+    """
+    Returns the plain text of an entity's description for indexing, read
+    straight from its file so indexing does not churn the description cache.
+    """
+    if not entity.description_path:
+        return entity.description
+    try:
+        with open(entity.description_path, 'r') as file:
+            text = file.read()
+    except OSError:
+        return ""
+    if entity.description_path.lower().endswith(('.htm', '.html')) and text.strip():
+        try:
+            return html.fromstring(text).text_content()
+        except etree.ParserError:
+            return ""
+    return text
+
+
+class TransitionTable:
+    """
+    Precompiled (node, answer) -> child transitions of a tree for running
+    cases through it. An answer is a link id or a link label, compared
+    case-insensitively; a label that leads to different children under the
+    same node is ambiguous and rejected.
+    """
+
+    AMBIGUOUS = object()
+
+    def __init__(self, store):
+        self.root_id = store.root_id
+        self.entities = store.entities
+        self.transitions = {}
+        for node_id, children in store.decision_tree.items():
+            for link_id, child_id in children.items():
+                self.transitions[(node_id, link_id)] = child_id
+                link = store.links.get(link_id)
+                if link is None or not link.label:
+                    continue
+                key = (node_id, normalize_answer(link.label))
+                if self.transitions.get(key, child_id) != child_id:
+                    child_id = self.AMBIGUOUS
+                self.transitions[key] = child_id
+        self.inner_nodes = {node_id for node_id, _ in self.transitions}
+
+    def evaluate(self, answers, start=None):
+        """
+        Walks `answers` from `start` (the root by default) and returns the
+        final node, its label, the path of node ids taken and a status:
+        'complete' once a leaf is reached, 'incomplete' when answers ran out
+        before one, or 'invalid_answer', 'ambiguous_answer' or
+        'unknown_node' with the failing step.
+        """
+        node_id = start or self.root_id
+        if node_id not in self.entities:
+            return {'status': 'unknown_node', 'node': node_id, 'path': []}
+
+        path = [node_id]
+        transitions = self.transitions
+        for step, answer in enumerate(answers):
+            child_id = transitions.get((node_id, answer))
+            if child_id is None and isinstance(answer, str):
+                child_id = transitions.get((node_id, normalize_answer(answer)))
+            if child_id is None or child_id is self.AMBIGUOUS:
+                return {'status': 'invalid_answer' if child_id is None else 'ambiguous_answer', 'step': step,
+                        'answer': answer, 'node': node_id, 'label': self.entities[node_id].label, 'path': path}
+            node_id = child_id
+            path.append(node_id)
+
+        status = 'incomplete' if node_id in self.inner_nodes else 'complete'
+        return {'status': status, 'node': node_id, 'label': self.entities[node_id].label, 'path': path}
+
+
+def normalize_answer(answer):
+    return " ".join(answer.split()).casefold()
+
+
+class TreeStats:
+    """
+    Access counts of one tree, aggregated over every worker in the tree's
+    STATS_FILE: how often it was loaded, how often get_children was asked
+    for each node and how often users moved from a parent to each child.
+    """
+
+    def __init__(self, loads=0, nodes=None, transitions=None):
+        self.loads = loads
+        self.nodes = nodes if nodes is not None else {}
+        self.transitions = transitions if transitions is not None else {}
+
+    def add(self, event):
+        if event[0] == 'load':
+            self.loads += 1
+            return
+        _, _, node_id, parent_id = event
+        self.nodes[node_id] = self.nodes.get(node_id, 0) + 1
+        if parent_id is not None:
+            children = self.transitions.setdefault(parent_id, {})
+            children[node_id] = children.get(node_id, 0) + 1
+
+    def merge(self, other):
+        self.loads += other.loads
+        for node_id, count in other.nodes.items():
+            self.nodes[node_id] = self.nodes.get(node_id, 0) + count
+        for parent_id, moves in other.transitions.items():
+            children = self.transitions.setdefault(parent_id, {})
+            for child_id, count in moves.items():
+                children[child_id] = children.get(child_id, 0) + count
+
+    def popular_nodes(self, limit):
+        return heapq.nlargest(limit, self.nodes, key=self.nodes.get)
+
+    def prefetch_hints(self, limit):
+        """
+        Maps every parent users moved away from to its `limit` children
+        they moved to most often.
+        """
+        if limit <= 0:
+            return {}
+        return {parent_id: heapq.nlargest(limit, children, key=children.get)
+                for parent_id, children in self.transitions.items()}
+
+    @classmethod
+    def load(cls, folder):
+        try:
+            with open(os.path.join(folder, STATS_FILE), 'r') as file:
+                if fcntl is not None:
+                    fcntl.flock(file, fcntl.LOCK_SH)
+                return cls._parse(file.read())
+        except OSError:
+            return cls()
+
+    @classmethod
+    def update(cls, folder, delta):
+        """
+        Adds `delta` to the tree's stats file and returns the merged stats.
+        The file is locked while it is rewritten, so workers flushing at the
+        same time keep each other's counts.
+        """
+        with open(os.path.join(folder, STATS_FILE), 'a+') as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            file.seek(0)
+            stats = cls._parse(file.read())
+            stats.merge(delta)
+            file.seek(0)
+            file.truncate()
+            file.write(json.dumps({'version': STATS_VERSION, 'loads': stats.loads, 'nodes': stats.nodes,
+                                   'transitions': stats.transitions}, separators=(',', ':')))
+        return stats
+
+    @classmethod
+    def _parse(cls, text):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return cls()
+        if not isinstance(data, dict) or data.get('version') != STATS_VERSION:
+            return cls()
+        return cls(data['loads'], data['nodes'], data['transitions'])
+
+
+class AccessLog:
+    """
+    Per-worker record of tree loads and get_children hits. Recording only
+    appends to a bounded deque, which is safe across threads without a
+    lock, so request handlers never wait on each other; when the deque is
+    full the oldest events are dropped. A background thread folds the
+    events into each tree's TreeStats every `flush_seconds` and refreshes
+    the prefetch hints of resident trees from the merged counts.
+    """
+
+    def __init__(self, flush_seconds=ACCESS_STATS_FLUSH_SECONDS, size=ACCESS_LOG_SIZE):
+        self.flush_seconds = flush_seconds
+        self._events = deque(maxlen=size)
+        self._flusher_pid = None
+        self._start_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            # Never fork, e.g. in the gunicorn master, halfway through a flush.
+            os.register_at_fork(before=self._flush_lock.acquire, after_in_parent=self._flush_lock.release,
+                                after_in_child=self._flush_lock.release)
+
+    def record_load(self, tree):
+        self._record(('load', tree))
+
+    def record_hit(self, tree, node_id, parent_id=None):
+        self._record(('hit', tree, node_id, parent_id))
+
+    def _record(self, event):
+        if self._flusher_pid != os.getpid():
+            self._start_flusher()
+        self._events.append(event)
+
+    def _start_flusher(self):
+        with self._start_lock:
+            if self._flusher_pid == os.getpid():
+                return
+            if self._flusher_pid is not None:
+                # A forked worker inherits the events its parent has not
+                # flushed yet; the parent still flushes them itself.
+                self._events.clear()
+            else:
+                atexit.register(self.flush)
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._run, name="access-stats", daemon=True).start()
+
+    def _run(self):
+        pid = os.getpid()
+        while self._flusher_pid == pid:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception as e:
+                app.logger.warning(f"Could not flush access statistics: {str(e)}")
+
+    def flush(self):
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        deltas = {}
+        while True:
+            try:
+                event = self._events.popleft()
+            except IndexError:
+                break
+            delta = deltas.get(event[1])
+            if delta is None:
+                delta = deltas[event[1]] = TreeStats()
+            delta.add(event)
+
+        with metrics.timer('stats_flush'):
+            for tree, delta in deltas.items():
+                if not os.path.isdir(tree):
+                    continue
+                stats = TreeStats.update(tree, delta)
+                store = tree_registry.peek(tree)
+                if store is not None:
+                    set_prefetch_hints(store, stats.prefetch_hints(PREFETCH_HINTS))
+
+
+access_log = AccessLog()
+
+
+def set_prefetch_hints(store, hints):
+    """
+    Replaces the store's prefetch hints and drops the encoded get_children
+    payloads of the nodes whose hint changed.
+    """
+    previous = store.prefetch
+    store.prefetch = hints
+    for node_id in previous.keys() | hints.keys():
+        if previous.get(node_id) != hints.get(node_id):
+            store.response_cache.pop((node_id, False), None)
+            store.response_cache.pop((node_id, True), None)
+
+
+def read_tree_generation(folder):
+    try:
+        with open(os.path.join(folder, GENERATION_FILE), 'r') as file:
+            return int(file.read().strip() or 0)
+    except (OSError, ValueError):
+        return None
+
+
+def write_tree_generation(folder, generation):
+    generation_path = os.path.join(folder, GENERATION_FILE)
+    temp_path = f"{generation_path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, 'w') as file:
+        file.write(str(generation))
+    os.replace(temp_path, generation_path)
+
+
+def read_recent_trees():
+    try:
+        with open(RECENT_TREES_FILE, 'r') as file:
+            names = json.loads(file.read())
+    except (OSError, ValueError):
+        return []
+    return [name for name in names if isinstance(name, str)] if isinstance(names, list) else []
+
+
+def remember_recent_tree(name):
+    """
+    Moves `name` to the front of RECENT_TREES_FILE, the trees most recently
+    loaded by any worker, which warm_up_trees preloads after a restart.
+    """
+    names = read_recent_trees()
+    if names[:1] == [name]:
+        return
+    names = [name] + [recent for recent in names if recent != name][:RECENT_TREES_KEPT - 1]
+    temp_path = f"{RECENT_TREES_FILE}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, 'w') as file:
+            file.write(json.dumps(names))
+        os.replace(temp_path, RECENT_TREES_FILE)
+    except OSError as e:
+        app.logger.warning(f"Could not record recently used tree '{name}': {str(e)}")
+
+
+class TreeRegistry:
+    """
+    Holds fully built EntityStore snapshots keyed by tree name.
+
+    Each tree is parsed once and then only read, so concurrent requests for
+    different trees never evict each other's data. The least recently used
+    tree is dropped once more than `max_trees` are resident.
+
+    Trees are served from their memory-mapped artifact, shared by every
+    worker process. A tree's generation file is bumped whenever it is
+    recompiled; workers compare it with the generation they attached at
+    most every GENERATION_CHECK_SECONDS and reattach when it moved.
+    """
+
+    def __init__(self, max_trees=MAX_LOADED_TREES):
+        self.max_trees = max_trees
+        self._trees = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks = {}
+
+    def get(self, name):
+        store = self._lookup(name)
+        if store is not None and self._is_current(name, store):
+            return store
+
+        with self._load_lock(name):
+            current = self._lookup(name)
+            if current is None or current is store:
+                if current is not None:
+                    metrics.increment('tree_reloads_total')
+                store = self._reload(name, current) if current is not None else self.load(name)
+            else:
+                store = current
+        return store
+
+    def _load_lock(self, name):
+        """
+        Returns the lock serializing loads and compiles of `name` in this
+        process. It is reentrant, since load and add call each other.
+        """
+        with self._lock:
+            return self._load_locks.setdefault(name, threading.RLock())
+
+    def _reload(self, name, current):
+        """
+        Replaces a resident tree whose sources changed. Readers holding
+        `current` keep using it; when the edited tree does not parse or
+        validate, `current` stays registered and the edit is not tried again
+        until the tree's files change once more. Well-formed XML missing
+        parts of a topic or association fails the parser with one of the
+        lookup errors caught here.
+        """
+        sources = tree_sources_signature(name, current.xml_path)
+        try:
+            store = self.load(name, current.xml_path, previous=current)
+        except (TreeValidationError, etree.XMLSyntaxError, AttributeError, IndexError, KeyError, TypeError) as e:
+            app.logger.error(f"Keeping the previous version of tree '{name}' until its files change: {str(e)}")
+            current.rejected_sources = sources
+            return current
+        return store
+
+    def load(self, name, xml_path=None, use_snapshot=True, previous=None, on_stage=None):
+        """
+        Loads a tree from its compiled snapshot when that is still current.
+        Otherwise the XML is parsed again, only in the elements that changed
+        when `previous` is the store built from an earlier version of the
+        file, and a fresh snapshot is compiled. `on_stage` is called with
+        'parsing' and 'building' as a full parse reaches those stages.
+        """
+        with self._load_lock(name):
+            return self._load(name, xml_path, use_snapshot, previous, on_stage)
+
+    def _load(self, name, xml_path, use_snapshot, previous, on_stage):
+        if xml_path is None:
+            xml_path = os.path.join(name, f"{name}.xml")
+        if not os.path.exists(xml_path):
+            raise NotFound(f"Tree file '{os.path.basename(xml_path)}' not found in folder '{name}'")
+
+        if use_snapshot:
+            started = time.perf_counter()
+            source_mtime = tree_source_mtime(name, xml_path)
+            store = EntityStore.load_snapshot(os.path.join(name, SNAPSHOT_FILE), source_mtime)
+            if store is not None:
+                metrics.observe('tree_stage_duration_seconds', time.perf_counter() - started, stage='attach')
+                metrics.increment('tree_loads_total', source='artifact')
+                self._prepare(name, store, xml_path, source_mtime)
+                return store
+
+        if previous is not None:
+            store = self._reparse(name, previous, xml_path)
+            if store is not None:
+                return store
+
+        store = EntityStore()
+        order = []
+        if on_stage is not None:
+            on_stage('parsing')
+        with metrics.timer('parse'):
+            store.parse_xtm_file(xml_path, order)
+        if on_stage is not None:
+            on_stage('building')
+        with metrics.timer('build'):
+            store.build_decision_tree()
+        metrics.increment('tree_loads_total', source='xml')
+        return self.add(name, store, xml_path, order)
+
+    def _reparse(self, name, previous, xml_path):
+        """
+        Rebuilds a changed tree from `previous`, parsing only the elements
+        whose digests are not in the tree's sources file. Returns None when
+        that is not possible and the file has to be parsed in full.
+        """
+        sources = TreeSources.load(os.path.join(name, SOURCES_FILE))
+        if sources is None or sources.source_mtime != previous.source_mtime:
+            return None
+        elements = TreeSources.scan(xml_path, sources.keys)
+        if elements is None:
+            return None
+        try:
+            with metrics.timer('reparse'):
+                store, order = EntityStore.reparse(previous, sources, elements)
+        except (etree.XMLSyntaxError, AttributeError, IndexError, KeyError) as e:
+            app.logger.warning(f"Falling back to a full parse of tree '{name}': {str(e)}")
+            return None
+        with metrics.timer('build'):
+            store.build_decision_tree()
+        metrics.increment('tree_loads_total', source='incremental')
+        return self.add(name, store, xml_path, order, elements)
+
+    def add(self, name, store, xml_path, order=None, elements=None):
+        """
+        Compiles a freshly built store into its shared artifact, bumps the
+        tree's generation and makes the mapped store current for `name`.
+        With the parser's `order`, also records the element digests the
+        next incremental reload compares against. Returns the store that
+        was registered.
+
+        The generation file is only moved once the new artifact is in
+        place, so it never names a generation no artifact carries yet.
+        """
+        with self._load_lock(name):
+            snapshot_path = os.path.join(name, SNAPSHOT_FILE)
+            source_mtime = tree_source_mtime(name, xml_path)
+            try:
+                generation = (read_tree_generation(name) or 0) + 1
+                with metrics.timer('compile'):
+                    store.save_snapshot(snapshot_path, source_mtime, generation)
+                write_tree_generation(name, generation)
+                store = EntityStore.load_snapshot(snapshot_path, source_mtime) or store
+                self._save_sources(name, xml_path, order, elements, source_mtime)
+            except OSError as e:
+                app.logger.warning(f"Could not write snapshot for tree '{name}': {str(e)}")
+            self._prepare(name, store, xml_path, source_mtime)
+            return store
+
+    def _save_sources(self, name, xml_path, order, elements, source_mtime):
+        sources_path = os.path.join(name, SOURCES_FILE)
+        sources = None
+        if order is not None:
+            sources = TreeSources.from_parse(elements or TreeSources.scan(xml_path), order, source_mtime)
+        if sources is not None:
+            sources.save(sources_path)
+        elif os.path.exists(sources_path):
+            os.remove(sources_path)
+
+    def _prepare(self, name, store, xml_path, source_mtime):
+        store.name = name
+        store.xml_path = xml_path
+        store.source_mtime = source_mtime
+        images_folder = os.path.join(name, 'images')
+        if os.path.isdir(images_folder):
+            # Created before images_mtime is taken, so variants generated on
+            # demand later never look like an edit of the tree's images.
+            try:
+                os.makedirs(os.path.join(images_folder, VARIANTS_FOLDER), exist_ok=True)
+            except OSError:
+                pass
+        store.assets = AssetIndex.build(name)
+        store.images_mtime = tree_images_mtime(name)
+        store.checked_at = time.monotonic()
+        store.prefetch = TreeStats.load(name).prefetch_hints(PREFETCH_HINTS)
+        self._put(name, store)
+        remember_recent_tree(name)
+        access_log.record_load(name)
+
+    def peek(self, name):
+        """
+        Returns the resident store for `name` without loading it.
+        """
+        with self._lock:
+            return self._trees.get(name)
+
+    def resident(self):
+        """
+        Returns (name, store) pairs for every tree currently loaded.
+        """
+        with self._lock:
+            return list(self._trees.items())
+
+    def discard(self, name):
+        with self._lock:
+            self._trees.pop(name, None)
+            self._load_locks.pop(name, None)
+
+    def _is_current(self, name, store):
+        """
+        Tells whether `store` still matches its tree: no other process
+        recompiled it and its XML, texts and images are unchanged, or only
+        changed into a version that was already rejected. Checked at most
+        every GENERATION_CHECK_SECONDS.
+        """
+        now = time.monotonic()
+        if now - store.checked_at < GENERATION_CHECK_SECONDS:
+            return True
+        store.checked_at = now
+        if store.generation is not None and read_tree_generation(name) != store.generation:
+            return False
+        sources = tree_sources_signature(name, store.xml_path)
+        if sources is None:
+            return False
+        return sources == (store.source_mtime, store.images_mtime) or sources == store.rejected_sources
+
+    def _lookup(self, name):
+        with self._lock:
+            store = self._trees.get(name)
+            if store is not None:
+                self._trees.move_to_end(name)
+            return store
+
+    def _put(self, name, store):
+        with self._lock:
+            self._trees[name] = store
+            self._trees.move_to_end(name)
+            while len(self._trees) > self.max_trees:
+                evicted, _ = self._trees.popitem(last=False)
+                self._load_locks.pop(evicted, None)
+                metrics.increment('tree_evictions_total')
+
+
+tree_registry = TreeRegistry()
+
+
+class TreeCatalog:
+    """
+    In-memory metadata for every tree folder in the working directory.
+
+    Folders are rescanned at most every `refresh_seconds` unless the working
+    directory's mtime changes, and only folders whose own mtime or
+    description file changed are re-read. Uploads and deletes update the
+    catalog directly.
+    """
+
+    def __init__(self, root='.', refresh_seconds=CATALOG_REFRESH_SECONDS):
+        self.root = root
+        self.refresh_seconds = refresh_seconds
+        self._entries = {}
+        self._root_mtime = None
+        self._scanned_at = 0.0
+        self._lock = threading.Lock()
+
+    def list(self, query=None):
+        self._refresh()
+        with self._lock:
+            entries = sorted(self._entries.values(), key=lambda entry: entry['name'])
+        if query:
+            query = query.lower()
+            entries = [entry for entry in entries if query in entry['name'].lower()]
+        return [self._with_status(entry) for entry in entries]
+
+    def update(self, name):
+        entry = self._read_entry(name)
+        with self._lock:
+            if entry is None:
+                self._entries.pop(name, None)
+            else:
+                self._entries[name] = entry
+
+    def remove(self, name):
+        with self._lock:
+            self._entries.pop(name, None)
+
+    def _refresh(self):
+        root_mtime = os.stat(self.root).st_mtime_ns
+        now = time.monotonic()
+        with self._lock:
+            if root_mtime == self._root_mtime and now - self._scanned_at < self.refresh_seconds:
+                return
+            known = dict(self._entries)
+
+        entries = {}
+        for entry in os.scandir(self.root):
+            if entry.is_dir() and entry.name not in FOLDER_IGNORE_LIST:
+                cached = known.get(entry.name)
+                if cached is not None and cached['_signature'] == self._signature(entry.path):
+                    entries[entry.name] = cached
+                else:
+                    entries[entry.name] = self._read_entry(entry.name)
+
+        with self._lock:
+            self._entries = {name: entry for name, entry in entries.items() if entry is not None}
+            self._root_mtime = root_mtime
+            self._scanned_at = now
+
+    def _signature(self, folder):
+        # The inode and size tell a deleted and re-uploaded tree from the old
+        # one even when extraction kept the archived mtimes.
+        description_file_path = os.path.join(folder, 'description.txt')
+        description = os.stat(description_file_path) if os.path.isfile(description_file_path) else None
+        folder_stat = os.stat(folder)
+        return (folder_stat.st_ino, folder_stat.st_mtime_ns,
+                (description.st_ino, description.st_mtime_ns, description.st_size) if description else None)
+
+    def _read_entry(self, name):
+        folder = os.path.join(self.root, name)
+        if not os.path.isdir(folder):
+            return None
+
+        description = 'No description available'
+        description_file_path = os.path.join(folder, 'description.txt')
+        if os.path.isfile(description_file_path):
+            with open(description_file_path, 'r') as file:
+                description = file.read().strip()
+
+        asset_size = 0
+        for directory, _, files in os.walk(folder):
+            for file_name in files:
+                asset_size += os.path.getsize(os.path.join(directory, file_name))
+
+        return {
+            'name': name,
+            'description': description,
+            'asset_size': asset_size,
+            'node_count': None,
+            '_signature': self._signature(folder)
+        }
+
+    def _with_status(self, entry):
+        store = tree_registry.peek(entry['name'])
+        if store is not None:
+            entry['node_count'] = len(store.entities)
+        return {
+            'name': entry['name'],
+            'description': entry['description'],
+            'node_count': entry['node_count'],
+            'asset_size': entry['asset_size'],
+            'status': 'loaded' if store is not None else 'available'
+        }
+
+
+tree_catalog = TreeCatalog()
+
+
+def warm_up_trees(names=None):
+    """
+    Loads `names` into the registry, by default PRELOAD_TREES or else the
+    PRELOAD_RECENT_TREES most recently used trees, and encodes the
+    get_children payloads of their root and their PRELOAD_POPULAR_NODES
+    most requested nodes. When this runs in the gunicorn master before it forks (see
+    gunicorn.conf.py), workers start with these trees resident and share
+    their pages copy-on-write. Returns the names that were loaded.
+    """
+    if names is None:
+        names = PRELOAD_TREES or read_recent_trees()[:PRELOAD_RECENT_TREES]
+    loaded = []
+    # Least recent first, so the registry's LRU order matches the list.
+    for name in reversed(names[:tree_registry.max_trees]):
+        try:
+            store = tree_registry.get(name)
+            if store.root_id:
+                get_children_response(store, store.root_id)
+            for node_id in TreeStats.load(name).popular_nodes(PRELOAD_POPULAR_NODES):
+                get_children_response(store, node_id)
+        except Exception as e:
+            app.logger.warning(f"Could not preload tree '{name}': {str(e)}")
+            continue
+        loaded.append(name)
+    tree_catalog.list()
+    return loaded[::-1]
+
+
+class UploadJob:
+    """
+    Tracks one background tree upload through its extracting, parsing and
+    building stages. Each job owns its uploaded bytes and result. Its state
+    is written to JOBS_FOLDER on every change, so any worker can answer
+    /api/jobs for a job another worker runs.
+    """
+
+    ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+
+    def __init__(self, filename):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.stage = 'queued'
+        self.progress = 0.0
+        self.error = None
+        self.tree = None
+        self.root = None
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def update(self, stage, progress):
+        self.stage = stage
+        self.progress = progress
+        self.save()
+
+    def finish(self, error=None):
+        self.finished_at = time.time()
+        if error is None:
+            self.update('done', 1.0)
+        else:
+            self.stage = 'failed'
+            self.error = error
+            self.save()
+
+    def save(self):
+        os.makedirs(JOBS_FOLDER, exist_ok=True)
+        path = os.path.join(JOBS_FOLDER, f"{self.id}.json")
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w') as file:
+            file.write(json.dumps(self.to_dict()))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def read(cls, job_id):
+        """
+        Returns the saved state of the job `job_id`, or None when there is
+        no such job.
+        """
+        if not cls.ID_PATTERN.fullmatch(job_id):
+            return None
+        try:
+            with open(os.path.join(JOBS_FOLDER, f"{job_id}.json"), 'r') as file:
+                return json.loads(file.read())
+        except (OSError, ValueError):
+            return None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'stage': self.stage,
+            'progress': self.progress,
+            'error': self.error,
+            'tree': self.tree,
+            'root': self.root
+        }
+
+
+def get_requested_store():
+    """
+    Returns the store for the tree named in the 'name' query parameter.
+    The name is required: node ids are not unique across trees, and which
+    tree was used last differs between requests and worker processes.
+    """
+    name = request.args.get("name", "").strip()
+    if not name:
+        raise BadRequest("Missing 'name' parameter")
+    return tree_registry.get(name)
 
 
 @app.route("/api/get_children", methods=["GET"])
 def get_children():
+    try:
+        node_ids = get_id_list_arg("node")
+        if not node_ids:
+            raise BadRequest("Missing 'node' parameter")
+
+        summary = request.args.get("descriptions", "").lower() in ("0", "false")
+        depth = get_int_arg("depth")
+        store = get_requested_store()
+        if len(node_ids) > 1 or depth is not None:
+            if depth == 0:
+                raise BadRequest("'depth' must be at least 1")
+            missing = next((node_id for node_id in node_ids if node_id not in store.entities), None)
+            if missing is not None:
+                raise NotFound(f"Node with id '{missing}' not found")
+            if len(node_ids) == 1:
+                record_node_hit(store, node_ids[0])
+            return jsonify(collect_subtree(store, node_ids, depth or 1, summary, set(get_id_list_arg("known"))))
+
+        node_id = node_ids[0]
+        cached = get_children_response(store, node_id, summary)
+        if not cached:
+            raise NotFound(f"Node with id '{node_id}' not found")
+        record_node_hit(store, node_id)
+
+        body, etag = cached
+        response = app.response_class(body, mimetype=app.json.mimetype)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+    except Exception as e:
+        app.logger.error(f"Error in get_children: {str(e)}")
+        if isinstance(e, HTTPException):
+            raise
+        raise InternalServerError("An unexpected error occurred")
+
+
+@app.route("/api/tree_export", methods=["GET"])
+def export_tree():
+    try:
+        store = get_requested_store()
+        if store.root_id is None:
+            raise NotFound("No tree found")
+
+        summary = request.args.get("descriptions", "").lower() in ("0", "false")
+        body, compressed, etag = get_tree_export(store, summary)
+        use_gzip = 'gzip' in request.accept_encodings
+        response = app.response_class(compressed if use_gzip else body, mimetype=app.json.mimetype)
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(f"{etag}-gzip" if use_gzip else etag)
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = 'no-cache'
+        return response.make_conditional(request)
+    except Exception as e:
+        app.logger.error(f"Error in export_tree: {str(e)}")
+        if isinstance(e, HTTPException):
+            raise
+        raise InternalServerError("An unexpected error occurred")
+
+
+@app.route("/api/search", methods=["GET"])
+def search():
+    try:
+        query = request.args.get("q", "").strip()
+        if not query:
+            raise BadRequest("Missing 'q' parameter")
+
+        name = request.args.get("name")
+        trees = [(name.strip(), tree_registry.get(name.strip()))] if name else tree_registry.resident()
+        per_page = get_int_arg("per_page", SEARCH_PAGE_SIZE) or SEARCH_PAGE_SIZE
+        page = max(get_int_arg("page", 1), 1)
+        total, hits = search_trees(trees, query, page * per_page)
+
+        results = [search_result(tree, store, node_id, kind, score)
+                   for score, tree, store, node_id, kind in hits[(page - 1) * per_page:]]
+        return jsonify(results), 200, {"X-Total-Count": str(total)}
+    except Exception as e:
+        app.logger.error(f"Error in search: {str(e)}")
+        if isinstance(e, HTTPException):
+            raise
+        raise InternalServerError("An unexpected error occurred")
+
+
+@app.route("/api/evaluate", methods=["POST"])
+def evaluate():
+    try:
+        store = get_requested_store()
+        if store.root_id is None:
+            raise NotFound("No tree found")
+
+        results = evaluate_cases(store, read_cases())
+        if request.args.get("stream", "").lower() in ("1", "true") \
+                or 'application/x-ndjson' in request.accept_mimetypes.values():
+            lines = (json.dumps(result, separators=(',', ':'), ensure_ascii=False) + "\n" for result in results)
+            return Response(stream_lines(lines), mimetype='application/x-ndjson')
+        return jsonify({"results": list(results)})
+    except Exception as e:
+        app.logger.error(f"Error in evaluate: {str(e)}")
+        if isinstance(e, HTTPException):
+            raise
+        raise InternalServerError("An unexpected error occurred")
+
+
+@app.route("/api/description", methods=["GET"])
+def get_description():
     try:
         node_id = request.args.get("node")
         if not node_id:
             raise BadRequest("Missing 'node' parameter")
 
-        node = create_node(node_id)
-        if not node:
+        store = get_requested_store()
+        entity = store.entities.get(node_id) or store.links.get(node_id)
+        if entity is None:
             raise NotFound(f"Node with id '{node_id}' not found")
 
-        return jsonify(node)
+        return jsonify({"id": node_id, "description": entity.description})
     except Exception as e:
-        app.logger.error(f"Error in get_children: {str(e)}")
+        app.logger.error(f"Error in get_description: {str(e)}")
+        if isinstance(e, HTTPException):
+            raise
         raise InternalServerError("An unexpected error occurred")
 
 
@@ -232,12 +2428,23 @@ def get_image():
         if not filename:
             raise BadRequest("Missing 'image' parameter")
 
-        if not os.path.exists(filename):
+        assets = get_tree_assets(filename.split('/')[0])
+        if (assets is None or assets.get(filename) is None) and not is_tree_image(filename):
             raise NotFound(f"Image '{filename}' not found")
 
-        return send_file(filename)
+        if not filename.lower().endswith(RASTER_IMAGE_EXTENSIONS):
+            return send_asset(filename, assets)
+
+        accepts_webp = 'image/webp' in request.accept_mimetypes.values()
+        variant_path, variant = select_image_variant(filename, get_int_arg("w"), accepts_webp,
+                                                     assets.get(filename) if assets is not None else None)
+        response = send_asset(variant_path, assets, original=filename, variant=variant)
+        response.vary.add('Accept')
+        return response
     except Exception as e:
         app.logger.error(f"Error in get_image: {str(e)}")
+        if isinstance(e, HTTPException):
+            raise
         raise InternalServerError("An unexpected error occurred")
 
 
@@ -248,23 +2455,15 @@ def start_tree():
         if not folder:
             raise BadRequest("Missing 'name' parameter")
 
-        folder = folder.strip()
-        file = f"{folder}.xml"
-
-        if not os.path.exists(os.path.join(folder, file)):
-            raise NotFound(f"Tree file '{file}' not found in folder '{folder}'")
-
-        entity_store.clear_tree()
-        entity_store.parse_xtm_file(os.path.join(folder, file))
-        entity_store.build_decision_tree()
-
-        root_node = entity_store.find_root_node()
+        root_node = tree_registry.get(folder.strip()).find_root_node()
         if not root_node:
             raise NotFound("No root node found in the parsed tree")
 
         return jsonify(root_node)
     except Exception as e:
         app.logger.error(f"Error in start_tree: {str(e)}")
+        if isinstance(e, HTTPException):
+            raise
         raise InternalServerError("An unexpected error occurred")
 
 
@@ -280,27 +2479,55 @@ def delete_tree():
             raise NotFound(f"Folder '{folder}' not found")
 
         shutil.rmtree(folder)
+        tree_registry.discard(folder)
+        tree_catalog.remove(folder)
         return jsonify({"message": f"Tree '{folder}' has been deleted"})
     except Exception as e:
         app.logger.error(f"Error in delete_tree: {str(e)}")
+        if isinstance(e, HTTPException):
+            raise
+        raise InternalServerError("An unexpected error occurred")
+
+
+@app.route('/api/tree/validate', methods=["GET"])
+def validate_tree():
+    try:
+        folder = request.args.get("name")
+        if not folder:
+            raise BadRequest("Missing 'name' parameter")
+
+        folder = folder.strip()
+        xml_path = os.path.join(folder, f"{folder}.xml")
+        if not os.path.exists(xml_path):
+            raise NotFound(f"Tree file '{folder}.xml' not found in folder '{folder}'")
+
+        store = EntityStore()
+        store.parse_xtm_file(xml_path)
+        store.build_adjacency()
+        return jsonify(store.validate())
+    except Exception as e:
+        app.logger.error(f"Error in validate_tree: {str(e)}")
+        if isinstance(e, HTTPException):
+            raise
         raise InternalServerError("An unexpected error occurred")
 
 
 @app.route('/api/trees', methods=["GET"])
 def get_trees():
     try:
-        folder_objects = []
-        for item in os.listdir():
-            if os.path.isdir(item) and item not in FOLDER_IGNORE_LIST:
-                description = 'No description available'
-                description_file_path = os.path.join(item, 'description.txt')
-                if os.path.isfile(description_file_path):
-                    with open(description_file_path, 'r') as file:
-                        description = file.read().strip()
-                folder_objects.append({'name': item, 'description': description})
-        return jsonify(folder_objects)
+        folder_objects = tree_catalog.list(request.args.get("q"))
+        total = len(folder_objects)
+
+        per_page = get_int_arg("per_page")
+        if per_page:
+            page = max(get_int_arg("page", 1), 1)
+            folder_objects = folder_objects[(page - 1) * per_page:page * per_page]
+
+        return jsonify(folder_objects), 200, {"X-Total-Count": str(total)}
     except Exception as e:
         app.logger.error(f"Error in get_trees: {str(e)}")
+        if isinstance(e, HTTPException):
+            raise
         raise InternalServerError("An unexpected error occurred")
 
 
@@ -314,31 +2541,49 @@ def load_tree():
         if not uploaded_file.filename:
             raise BadRequest("No file selected")
 
+        import ingest
+
         # Extract the tree name from the uploaded file
         tree_name = os.path.splitext(uploaded_file.filename)[0]
 
         # Check if a tree with this name already exists
         if tree_exists(tree_name):
-            raise Conflict(
-                f"A tree with the name '{tree_name}' already exists. Please choose a different name or delete the existing tree first.")
+            raise ingest.tree_conflict(tree_name)
+
+        if request.args.get("async", "").lower() in ("1", "true"):
+            job = ingest.submit_upload_job(uploaded_file)
+            return jsonify(job.to_dict()), 202, {"Location": f"/api/jobs/{job.id}"}
 
-        entity_store.clear_tree()
-        xml_file, xml_file_folder = extract_files(uploaded_file)
-        entity_store.parse_xtm_file(os.path.join(xml_file_folder, xml_file))
-        entity_store.build_decision_tree()
+        xml_file, xml_file_folder, image_timings = ingest.extract_files(uploaded_file)
+        store = tree_registry.load(xml_file_folder, os.path.join(xml_file_folder, xml_file), use_snapshot=False)
+        tree_catalog.update(xml_file_folder)
 
-        root_node = entity_store.find_root_node()
+        root_node = store.find_root_node()
         if not root_node:
             raise NotFound("No root node found in the uploaded tree")
 
+        root_node["ingest"] = {"images": image_timings}
         return jsonify(root_node)
     except Exception as e:
         app.logger.error(f"Error in load_triads: {str(e)}")
-        if isinstance(e, (BadRequest, NotFound, Conflict)):
+        if isinstance(e, HTTPException):
             raise
         raise InternalServerError("An unexpected error occurred")
 
 
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = UploadJob.read(job_id)
+    if job is None:
+        raise NotFound(f"Job '{job_id}' not found")
+    return jsonify(job)
+
+
+@app.route("/api/metrics", methods=["GET"])
+def get_metrics():
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 @app.route("/api/test", methods=["GET"])
 def test():
     return jsonify({"message": "Hello World!"})
@@ -347,14 +2592,40 @@ def test():
 @app.route("/api/tree_ascii", methods=["GET"])
 def get_tree_ascii():
     try:
-        root_node = entity_store.find_root_node()
-        if not root_node:
+        store = get_requested_store()
+        if store.root_id is None:
             raise NotFound("No tree found")
 
-        tree_ascii = generate_tree_ascii(root_node)
+        max_depth = get_int_arg("max_depth")
+        if request.args.get("stream", "").lower() in ("1", "true"):
+            return Response(stream_lines(render_tree_ascii(store, max_depth)), mimetype='text/plain')
+
+        tree_ascii = generate_tree_ascii(store, max_depth)
         return jsonify({"tree_ascii": tree_ascii})
     except Exception as e:
         app.logger.error(f"Error in get_tree_ascii: {str(e)}")
+        if isinstance(e, HTTPException):
+            raise
+        raise InternalServerError("An unexpected error occurred")
+
+
+@app.route("/api/tree_render", methods=["GET"])
+def get_tree_render():
+    try:
+        render_format = request.args.get("format", "ascii")
+        if render_format not in TREE_RENDERERS:
+            raise BadRequest(f"Unsupported format '{render_format}'. Use one of: {', '.join(TREE_RENDERERS)}")
+
+        store = get_requested_store()
+        if store.root_id is None:
+            raise NotFound("No tree found")
+
+        render, mimetype = TREE_RENDERERS[render_format]
+        return Response(stream_lines(render(store, get_int_arg("max_depth"))), mimetype=mimetype)
+    except Exception as e:
+        app.logger.error(f"Error in get_tree_render: {str(e)}")
+        if isinstance(e, HTTPException):
+            raise
         raise InternalServerError("An unexpected error occurred")
 
 
@@ -366,14 +2637,35 @@ def get_tree_graph():
             raise BadRequest("Missing 'name' parameter")
 
         folder, filename = path.split('/')
-        matching_files = [file for file in os.listdir(folder) if file.startswith(filename)]
+        assets = get_tree_assets(folder)
+        if assets is not None:
+            matching_files = [name for name in [assets.find_graph(filename)] if name]
+        else:
+            matching_files = sorted(file for file in os.listdir(folder) if file.startswith(filename))
 
         if not matching_files:
             raise NotFound(f"No matching files found for '{filename}' in folder '{folder}'")
 
-        return send_file(os.path.join(folder, matching_files[0]))
+        return send_asset(os.path.join(folder, matching_files[0]), assets)
     except Exception as e:
         app.logger.error(f"Error in get_tree_graph: {str(e)}")
+        if isinstance(e, HTTPException):
+            raise
+        raise InternalServerError("An unexpected error occurred")
+
+
+@app.route("/api/assets", methods=["GET"])
+def get_assets():
+    try:
+        folder = request.args.get("name")
+        if not folder:
+            raise BadRequest("Missing 'name' parameter")
+
+        return jsonify(tree_registry.get(folder.strip()).assets.urls())
+    except Exception as e:
+        app.logger.error(f"Error in get_assets: {str(e)}")
+        if isinstance(e, HTTPException):
+            raise
         raise InternalServerError("An unexpected error occurred")
 
 
@@ -384,239 +2676,553 @@ def get_paths():
         if not node_id:
             raise BadRequest("Missing 'node' parameter")
 
-        paths = find_paths_to_node(node_id)
+        store = get_requested_store()
+        if node_id not in store.entities:
+            raise NotFound(f"Node with id '{node_id}' not found")
+
+        if request.args.get("shortest", "").lower() in ("1", "true"):
+            path = shortest_path_to_node(store, node_id)
+            paths = [[store.entities[path_id].to_dict() for path_id in path]] if path else []
+            truncated = False
+        else:
+            limit = min(get_int_arg("limit", MAX_PATHS), MAX_PATHS)
+            paths, truncated = find_paths_to_node(store, node_id, limit=max(limit, 1),
+                                                  max_depth=get_int_arg("max_depth"))
         if not paths:
             raise NotFound(f"No paths found to node with id '{node_id}'")
         paths.reverse()
-        return jsonify(paths)
+        return jsonify(paths), 200, {"X-Paths-Truncated": "true" if truncated else "false"}
     except Exception as e:
         app.logger.error(f"Error in get_paths: {str(e)}")
+        if isinstance(e, HTTPException):
+            raise
         raise InternalServerError("An unexpected error occurred")
 
 
-def generate_tree_ascii(node, visited=None, node_ids=None, prefix="", is_last=True):
-    if visited is None:
-        visited = set()
-    if node_ids is None:
-        node_ids = {}
-
-    tree_ascii = prefix
-    if is_last:
-        tree_ascii += "└── "
-        prefix += "    "
+def get_tree_assets(folder):
+    store = tree_registry.peek(folder)
+    return store.assets if store is not None else None
+
+
+def send_asset(path, assets=None, original=None, variant=None):
+    """
+    Sends a tree asset with its content hash as ETag, using a precompressed
+    copy when the client accepts one. Requests carrying the current hash as
+    'v' are marked immutable; anything else must revalidate. A derived image
+    is sent with the hash of its `original`, tagged with `variant`.
+    """
+    content_hash = assets.get(original or path) if assets is not None else None
+    send_path, encoding = path, None
+    if path.lower().endswith(PRECOMPRESSED_EXTENSIONS):
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            compressed_path = compressed_asset_path(path, suffix)
+            if candidate in request.accept_encodings and os.path.exists(compressed_path):
+                send_path, encoding = compressed_path, candidate
+                break
+
+    etag = f"{content_hash}-{variant}" if content_hash and variant else content_hash
+    etag = f"{etag}-{encoding}" if etag and encoding else etag
+    response = send_file(send_path, mimetype=mimetypes.guess_type(path)[0], etag=etag if etag else True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if path.lower().endswith(PRECOMPRESSED_EXTENSIONS):
+        response.vary.add('Accept-Encoding')
+
+    if content_hash and request.args.get("v") == content_hash:
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
     else:
-        tree_ascii += "├── "
-        prefix += "│   "
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
 
-    node_id = node["root"]["id"]
-    if node_id not in node_ids:
-        node_ids[node_id] = len(node_ids) + 1
 
-    tree_ascii += f"[{node_ids[node_id]}] {node['root']['label']} [{node_id}]\n"
-
-    if node_id in visited:
-        return tree_ascii
+def get_int_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        number = int(value)
+    except ValueError:
+        raise BadRequest(f"'{name}' must be an integer")
+    if number < 0:
+        raise BadRequest(f"'{name}' must not be negative")
+    return number
+
+
+def get_id_list_arg(name):
+    """
+    Returns the ids passed as repeated `name` parameters or as one
+    comma-separated value, in order and without duplicates.
+    """
+    ids = (node_id.strip() for value in request.args.getlist(name) for node_id in value.split(','))
+    return list(dict.fromkeys(node_id for node_id in ids if node_id))
+
+
+def iter_tree(store, max_depth=None):
+    """
+    Walks the decision tree depth-first from the root without recursion.
+
+    Yields (depth, parent_id, link_id, node_id, is_last, repeat) for every
+    edge in child order, starting with the root itself. A node reached
+    again through another parent is yielded with `repeat` set and is not
+    expanded twice. Nodes at `max_depth` are yielded but not expanded.
+    """
+    root_id = store.root_id
+    if root_id is None:
+        return
+
+    yield 0, None, None, root_id, True, False
+    if max_depth == 0:
+        return
+
+    visited = {root_id}
+    stack = [(root_id, list(store.decision_tree.get(root_id, {}).items()), 0, [0])]
+
+    while stack:
+        node_id, children, depth, position = stack[-1]
+        if position[0] == len(children):
+            stack.pop()
+            continue
 
-    visited.add(node_id)
+        link_id, child_id = children[position[0]]
+        position[0] += 1
+        repeat = child_id in visited
+        yield depth + 1, node_id, link_id, child_id, position[0] == len(children), repeat
+
+        if not repeat and (max_depth is None or depth + 1 < max_depth):
+            visited.add(child_id)
+            stack.append((child_id, list(store.decision_tree.get(child_id, {}).items()), depth + 1, [0]))
+
+
+def render_tree_ascii(store, max_depth=None):
+    node_ids = {}
+    prefixes = []
+    for depth, _, _, node_id, is_last, _ in iter_tree(store, max_depth):
+        prefix = prefixes[depth - 1] if depth else ""
+        number = node_ids.setdefault(node_id, len(node_ids) + 1)
+        yield f"{prefix}{'└── ' if is_last else '├── '}[{number}] {store.entities[node_id].label} [{node_id}]\n"
+        del prefixes[depth:]
+        prefixes.append(prefix + ("    " if is_last else "│   "))
+
+
+def render_tree_dot(store, max_depth=None):
+    def quote(text):
+        return '"' + (text or "").replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    yield "digraph decision_tree {\n"
+    for _, parent_id, link_id, node_id, _, repeat in iter_tree(store, max_depth):
+        if not repeat:
+            yield f"    {quote(node_id)} [label={quote(store.entities[node_id].label)}];\n"
+        if parent_id is not None:
+            yield f"    {quote(parent_id)} -> {quote(node_id)} [label={quote(store.links[link_id].label)}];\n"
+    yield "}\n"
+
+
+def render_tree_mermaid(store, max_depth=None):
+    def quote(text):
+        return '"' + (text or "").replace('"', '#quot;') + '"'
+
+    node_ids = {}
+    yield "flowchart TD\n"
+    for _, parent_id, link_id, node_id, _, repeat in iter_tree(store, max_depth):
+        number = node_ids.setdefault(node_id, len(node_ids) + 1)
+        if not repeat:
+            yield f"    n{number}[{quote(store.entities[node_id].label)}]\n"
+        if parent_id is not None:
+            yield f"    n{node_ids[parent_id]} -->|{quote(store.links[link_id].label)}| n{number}\n"
+
+
+TREE_RENDERERS = {
+    'ascii': (render_tree_ascii, 'text/plain'),
+    'dot': (render_tree_dot, 'text/vnd.graphviz'),
+    'mermaid': (render_tree_mermaid, 'text/plain'),
+}
+
+
+def generate_tree_ascii(store, max_depth=None):
+    return "".join(render_tree_ascii(store, max_depth))
+
+
+def stream_lines(lines, chunk_size=64 * 1024):
+    """
+    Groups rendered lines into chunks of roughly `chunk_size` characters.
+    """
+    chunk, size = [], 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            yield "".join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield "".join(chunk)
+
+
+def is_tree_image(path):
+    """
+    Tells whether `path` names a file directly in a tree's images folder,
+    with links resolved, so /api/images never reads or derives files kept
+    anywhere else.
+    """
+    tree = path.split('/')[0]
+    if not tree or tree.startswith('.') or tree in FOLDER_IGNORE_LIST:
+        return False
+    real_path = os.path.realpath(path)
+    return os.path.dirname(real_path) == os.path.realpath(os.path.join(tree, 'images')) \
+        and not os.path.basename(real_path).startswith('.') and os.path.isfile(real_path)
+
+
+def hash_file(path):
+    with open(path, 'rb') as file:
+        return hashlib.blake2b(file.read(), digest_size=16).hexdigest()
+
+
+def image_variant_path(path, content_hash, width, webp):
+    """
+    Names a derivative of the image at `path` whose content hashes to
+    `content_hash`: `name.png.<hash>.w160.png` for a resized copy,
+    `name.png.<hash>.w160.webp` or `name.png.<hash>.webp` for WebP copies.
+    A replaced image gets new derivatives instead of the old ones.
+    Derivatives live in VARIANTS_FOLDER next to the image, so writing them
+    leaves the images folder, which is watched for edits, untouched.
+    """
+    folder, file_name = os.path.split(path)
+    extension = '.webp' if webp else os.path.splitext(path)[1]
+    if width is None:
+        return os.path.join(folder, VARIANTS_FOLDER, f"{file_name}.{content_hash}{extension}")
+    return os.path.join(folder, VARIANTS_FOLDER, f"{file_name}.{content_hash}.w{width}{extension}")
+
+
+def select_image_variant(path, width, webp, content_hash=None):
+    """
+    Returns the path of the variant of `path` best matching the requested
+    width and format, generating and keeping it on disk when missing, and a
+    tag naming that variant (None for the original itself). `content_hash`
+    is the image's hash when the tree's asset index has it.
+    """
+    if width is not None:
+        width = next((size for size in IMAGE_DERIVATIVE_WIDTHS if size >= width), None)
+    if width is None and not webp:
+        return path, None
+
+    variant_path = image_variant_path(path, content_hash or hash_file(path), width, webp)
+    if not os.path.exists(variant_path):
+        import ingest
+
+        with metrics.timer('image_encode'):
+            ingest.create_image_variant(path, variant_path, width)
+    image_format = 'webp' if webp else os.path.splitext(path)[1][1:].lower()
+    return variant_path, f"w{width or 'full'}-{image_format}"
 
-    children = node["children"]
-    for i, child in enumerate(children):
-        is_last_child = i == len(children) - 1
-        child_node = create_node(child["question"]["id"])
-        child_id = child_node["root"]["id"]
 
-        if child_id in visited:
-            tree_ascii += prefix + (
-                "└── " if is_last_child else "├── ") + f"[{node_ids[child_id]}] {child_node['root']['label']} [{child_id}]\n"
-        else:
-            tree_ascii += generate_tree_ascii(child_node, visited, node_ids, prefix, is_last_child)
-
-    return tree_ascii
+def tree_exists(tree_name):
+    return os.path.exists(tree_name) and os.path.isdir(tree_name)
 
 
-def extract_files(file):
-    file_extension = os.path.splitext(file.filename)[1].lower()
+def create_node(store, node_id, summary=False):
+    """
+    Builds the get_children payload for `node_id`. With `summary` the
+    children carry only their id, label and image, leaving descriptions to
+    /api/description.
+    """
+    node = store.entities.get(node_id)
+    if node is None:
+        return None
 
-    if file_extension == '.zip':
-        with zipfile.ZipFile(file, 'r') as zip_ref:
-            return _extract_from_zip(zip_ref)
-    elif file_extension == '.rar':
-        return _extract_from_rar(file)
+    if summary:
+        children_list = [
+            {
+                "question": store.entities[item[1]].to_summary_dict(),
+                "answer": store.links[item[0]].to_summary_dict()
+            }
+            for item in store.decision_tree.get(node_id, {}).items()
+        ]
     else:
-        raise BadRequest('Unsupported file type. Only ZIP and RAR are supported.')
-
-
-def _extract_from_zip(zip_ref):
-    xml_files = [f for f in zip_ref.namelist() if f.endswith('.xml')]
-    description_file = next((f for f in zip_ref.namelist() if f.endswith('description.txt')), None)
-
-    if not xml_files:
-        raise BadRequest('No XML files found in the zip')
-
-    xml_filename = xml_files[0]
-    folder_name = xml_filename.split('.')[0]
-
-    if tree_exists(folder_name):
-        raise Conflict(
-            f"A tree with the name '{folder_name}' already exists. Please choose a different name or delete the existing tree first.")
-
-    zip_ref.extract(xml_filename, folder_name)
-    if description_file:
-        zip_ref.extract(description_file, folder_name)
-
-    images_folder = os.path.join(folder_name, 'images')
-    texts_folder = os.path.join(folder_name, 'texts')
-    os.makedirs(images_folder, exist_ok=True)
-    os.makedirs(texts_folder, exist_ok=True)
-
-    for file_item in zip_ref.namelist():
-        if file_item.startswith('tree_graph'):
-            zip_ref.extract(file_item, folder_name)
-        elif file_item.endswith(('.png', '.jpg', '.jpeg')):
-            extracted_path = zip_ref.extract(file_item)
-
-            img = Image.open(extracted_path)
+        children_list = [
+            {
+                "question": store.entities[item[1]].to_dict(),
+                "answer": store.links[item[0]].to_dict()
+            }
+            for item in list(store.decision_tree.get(node_id, {}).items())
+        ]
+    return {"root": node.to_dict(), "children": children_list}
 
-            quality = 80
 
-            new_path = os.path.join(images_folder, os.path.basename(file_item))
-            img.save(new_path, optimize=True, quality=quality)
+def iter_paths_to_node(store, target_id, max_depth=None):
+    """
+    Lazily yields each root-to-node path ending at `target_id` as a tuple of
+    ids. The walk is depth first over a stack of parent iterators, so the
+    first path costs O(depth) however many paths there are; paths come out
+    in depth-first order, not shortest first.
+
+    `max_depth` bounds the number of edges in a path; by default it is the
+    number of entities, which also stops unreachable cycles from looping.
+    Parents whose shortest way up to the root is already too long are not
+    entered, so a bounded walk does not explore dead ends.
+    """
+    if max_depth is None:
+        max_depth = len(store.entities)
+
+    parents = store.parents.get(target_id)
+    if not parents:
+        yield (target_id,)
+        return
+
+    path = [target_id]
+    stack = [iter(parents)]
+    while stack:
+        parent_id = next(stack[-1], None)
+        if parent_id is None:
+            stack.pop()
+            path.pop()
+            continue
+        if len(path) > max_depth:
+            continue
+        depth = store.depth(parent_id) if store.graph is not None else None
+        if depth is not None and len(path) + depth > max_depth:
+            continue
 
-            os.remove(extracted_path)
-        elif file_item.endswith('.svg'):
-            extracted_path = zip_ref.extract(file_item)
-            new_path = os.path.join(images_folder, os.path.basename(file_item))
-            shutil.move(extracted_path, new_path)
+        parents = store.parents.get(parent_id)
+        if not parents:
+            yield (parent_id, *reversed(path))
         else:
-            extracted_path = zip_ref.extract(file_item, texts_folder if file_item.endswith(
-                ('.txt', '.htm', '.html')) else images_folder)
-            new_path = os.path.join(
-                texts_folder if file_item.endswith(('.txt', '.htm', '.html')) else images_folder,
-                os.path.basename(file_item))
-            shutil.move(extracted_path, new_path)
-            clean_up_empty_directories(os.path.dirname(extracted_path), images_folder, texts_folder)
-
-    return xml_filename, folder_name
-
-
-def _extract_from_rar(file):
-    temp_dir = "temp_extracted"
-    os.makedirs(temp_dir, exist_ok=True)
-
-    temp_file_path = os.path.join(temp_dir, file.filename)
-    file.save(temp_file_path)
-
-    patoolib.extract_archive(temp_file_path, outdir=temp_dir)
-
-    extracted_files = []
-    for root, _, files in os.walk(temp_dir):
-        extracted_files.extend([os.path.join(root, f) for f in files])
-
-    xml_files = [f for f in extracted_files if f.endswith('.xml')]
-    description_file = next((f for f in extracted_files if f.endswith('description.txt')), None)
-
-    if not xml_files:
-        raise BadRequest('No XML files found in the RAR')
-
-    xml_filename = os.path.basename(xml_files[0])
-    folder_name = os.path.splitext(xml_filename)[0]
-
-    if tree_exists(folder_name):
-        raise Conflict(
-            f"A tree with the name '{folder_name}' already exists. Please choose a different name or delete the existing tree first.")
-
-    os.makedirs(folder_name, exist_ok=True)
-
-    shutil.copy(xml_files[0], folder_name)
-    if description_file:
-        shutil.copy(description_file, folder_name)
-
-    images_folder = os.path.join(folder_name, 'images')
-    texts_folder = os.path.join(folder_name, 'texts')
-    os.makedirs(images_folder, exist_ok=True)
-    os.makedirs(texts_folder, exist_ok=True)
-
-    for file_item in extracted_files:
-        if file_item == 'description.txt':
+            path.append(parent_id)
+            stack.append(iter(parents))
+
+
+def shortest_path_to_node(store, target_id):
+    """
+    Returns one shortest root-to-node path as a tuple of ids, visiting each
+    node at most once.
+    """
+    next_hop = {target_id: None}
+    queue = deque([target_id])
+    while queue:
+        node_id = queue.popleft()
+        parents = store.parents.get(node_id)
+        if not parents:
+            path = []
+            while node_id is not None:
+                path.append(node_id)
+                node_id = next_hop[node_id]
+            return tuple(path)
+        for parent_id in parents:
+            if parent_id not in next_hop:
+                next_hop[parent_id] = node_id
+                queue.append(parent_id)
+    return None
+
+
+def get_children_response(store, node_id, summary=False):
+    """
+    Returns the encoded create_node payload for `node_id`, with the
+    children users most often open next as its `prefetch` hint, and its
+    ETag. Payloads are encoded once and kept on the store, so they are
+    dropped together with it when the tree is reloaded, evicted or deleted.
+    """
+    key = (node_id, summary)
+    cached = store.response_cache.get(key)
+    metrics.increment('response_cache_requests_total', result='miss' if cached is None else 'hit')
+    if cached is None:
+        node = create_node(store, node_id, summary)
+        if node is None:
+            return None
+        hints = store.prefetch.get(node_id)
+        if hints:
+            children = set(store.decision_tree.get(node_id, {}).values())
+            hints = [child_id for child_id in hints if child_id in children]
+        node["prefetch"] = hints or []
+        with metrics.timer('serialize'):
+            body = (app.json.dumps(node) + "\n").encode()
+        cached = (body, hashlib.blake2b(body, digest_size=16).hexdigest())
+        store.response_cache[key] = cached
+    return cached
+
+
+def record_node_hit(store, node_id):
+    """
+    Counts a get_children hit on `node_id` in the access log. The parent the
+    user came from is the 'from' query parameter, or else the node's only
+    parent.
+    """
+    if store.name is None:
+        return
+    parents = store.parents.get(node_id, ())
+    parent_id = request.args.get("from")
+    if parent_id is None or parent_id not in parents:
+        parent_id = parents[0] if len(parents) == 1 else None
+    access_log.record_hit(store.name, node_id, parent_id)
+
+
+def collect_subtree(store, node_ids, depth=None, summary=False, known=(), limit=MAX_SUBTREE_NODES):
+    """
+    Collects the nodes within `depth` levels below `node_ids` as flat
+    tables, so nodes reached along several paths are sent once: `entities`
+    and `links` are keyed by id and `children` holds the [link, child]
+    pairs of every expanded node. Nodes without a `children` entry were
+    not expanded. Ids in `known` are left out of the tables. Expansion
+    stops once `limit` nodes were collected and the result is marked
+    truncated.
+    """
+    entities, links, children = {}, {}, {}
+    seen = set(node_ids)
+    queue = deque((node_id, 0) for node_id in node_ids)
+    truncated = False
+    while queue:
+        node_id, level = queue.popleft()
+        if node_id not in known:
+            entities[node_id] = entity_payload(store.entities[node_id], summary)
+        if depth is not None and level >= depth:
+            continue
+        if limit is not None and len(seen) >= limit:
+            truncated = True
             continue
-        if file_item.startswith('tree_graph'):
-            shutil.move(file_item, folder_name)
-        elif file_item.endswith(('.png', '.jpg', '.jpeg')):
-            img = Image.open(file_item)
-            quality = 80
-            new_path = os.path.join(images_folder, os.path.basename(file_item))
-            img.save(new_path, optimize=True, quality=quality)
-            os.remove(file_item)
-        elif file_item.endswith('.svg'):
-            new_path = os.path.join(images_folder, os.path.basename(file_item))
-            shutil.copy(file_item, new_path)
-        elif file_item.endswith(('.txt', '.htm', '.html')):
-            new_path = os.path.join(
-                texts_folder if file_item.endswith(('.txt', '.htm', '.html')) else images_folder,
-                os.path.basename(file_item))
-            shutil.copy(file_item, new_path)
-            clean_up_empty_directories(os.path.dirname(file_item), images_folder, texts_folder)
-
-    shutil.rmtree(temp_dir)
-
-    return xml_filename, folder_name
-
-
-def tree_exists(tree_name):
-    return os.path.exists(tree_name) and os.path.isdir(tree_name)
-
 
-def clean_up_empty_directories(intermediate_dir, images_folder, texts_folder):
-    while intermediate_dir and intermediate_dir not in {images_folder, texts_folder}:
+        edges = children[node_id] = []
+        for link_id, child_id in store.decision_tree.get(node_id, {}).items():
+            edges.append([link_id, child_id])
+            if link_id not in links and link_id not in known:
+                links[link_id] = entity_payload(store.links[link_id], summary)
+            if child_id not in seen:
+                seen.add(child_id)
+                queue.append((child_id, level + 1))
+    return {"entities": entities, "links": links, "children": children, "truncated": truncated}
+
+
+def entity_payload(record, summary):
+    payload = record.to_summary_dict() if summary else record.to_dict()
+    del payload['id']
+    payload.pop('parent', None)
+    return payload
+
+
+def get_tree_export(store, summary=False):
+    """
+    Returns the whole tree as one compact JSON document, its gzip copy and
+    its ETag. Both encodings are built once and kept on the store.
+    """
+    key = ('export', summary)
+    cached = store.response_cache.get(key)
+    metrics.increment('response_cache_requests_total', result='miss' if cached is None else 'hit')
+    if cached is None:
+        payload = collect_subtree(store, [store.root_id], summary=summary, limit=None)
+        del payload['truncated']
+        payload = {"root": store.root_id, **payload}
+        with metrics.timer('serialize'):
+            body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode()
+            cached = (body, gzip.compress(body, 6), hashlib.blake2b(body, digest_size=16).hexdigest())
+        store.response_cache[key] = cached
+    return cached
+
+
+def get_search_index(store):
+    if store.search_index is None:
+        store.search_index = SearchIndex.load_or_build(store.name, store, store.source_mtime)
+    return store.search_index
+
+
+def search_trees(trees, query, limit):
+    """
+    Runs `query` against the search index of every (name, store) pair.
+    Each node counts once, under its best matching document. Returns the
+    number of matching nodes and the best `limit` of them as
+    (score, tree, store, node_id, kind) tuples.
+    """
+    hits = []
+    for tree, store in trees:
+        index = get_search_index(store)
+        best = {}
+        for doc, score in index.search(query).items():
+            kind, _, node_id = index.docs[doc]
+            if score > best.get(node_id, (0.0,))[0]:
+                best[node_id] = (score, kind)
+        hits.extend((score, tree, store, node_id, kind) for node_id, (score, kind) in best.items()
+                    if kind == 'node' or node_id in store.entities)
+    return len(hits), heapq.nlargest(limit, hits, key=lambda hit: hit[0])
+
+
+def search_result(tree, store, node_id, kind, score):
+    result = store.entities[node_id].to_summary_dict()
+    path = shortest_path_to_node(store, node_id) or (node_id,)
+    result.update({
+        'tree': tree,
+        'score': round(score, 4),
+        'matched': kind,
+        'breadcrumb': [{'id': path_id, 'label': store.entities[path_id].label} for path_id in path]
+    })
+    return result
+
+
+def read_cases():
+    """
+    Reads the cases of an /api/evaluate request: a JSON list, a JSON object
+    with a 'cases' list, or an NDJSON body with one case per line.
+    """
+    if request.mimetype == 'application/x-ndjson':
         try:
-            os.rmdir(intermediate_dir)
-        except OSError:
-            break
-        intermediate_dir = os.path.dirname(intermediate_dir)
-
-
-def create_node(node_id):
-    children_list = [
-        {
-            "question": entity_store.entities[item[1]].to_dict(),
-            "answer": entity_store.links[item[0]].to_dict()
-        }
-        for item in list(entity_store.decision_tree.get(node_id, {}).items())
-    ]
-    node = entity_store.entities.get(node_id)
-    return {"root": node.to_dict(), "children": children_list}
-
-
-def find_paths_to_node(target_id):
-    def build_parent_map():
-        parent_map = {}
-        for parent_id, children in entity_store.decision_tree.items():
-            for _, child_id in children.items():
-                if child_id not in parent_map:
-                    parent_map[child_id] = []
-                parent_map[child_id].append(parent_id)
-        return parent_map
-
-    def bfs():
-        parent_map = build_parent_map()
-        queue = deque([(target_id, [])])
-        paths = []
+            cases = [json.loads(line) for line in request.get_data().splitlines() if line.strip()]
+        except ValueError:
+            raise BadRequest("Every line must be a JSON case")
+    else:
+        body = request.get_json(silent=True)
+        cases = body.get('cases') if isinstance(body, dict) else body
+        if not isinstance(cases, list):
+            raise BadRequest("Expected a list of cases")
+    if len(cases) > MAX_EVALUATE_CASES:
+        raise RequestEntityTooLarge(f"At most {MAX_EVALUATE_CASES} cases can be evaluated per request")
+    return cases
+
+
+def get_transition_table(store):
+    if store.transitions is None:
+        with metrics.timer('transitions'):
+            store.transitions = TransitionTable(store)
+    return store.transitions
+
+
+def evaluate_cases(store, cases):
+    """
+    Runs each case through the tree and yields one result per case, in
+    order. A case is a list of answers (link ids or labels) or an object
+    with 'answers' and optionally 'id' and a 'start' node; results carry
+    the case id, or its position when it has none. Cases whose answers are
+    not all strings or integers are reported as invalid_case.
+    """
+    table = get_transition_table(store)
+    for position, case in enumerate(cases):
+        if isinstance(case, dict):
+            case_id, answers, start = case.get('id', position), case.get('answers'), case.get('start')
+        else:
+            case_id, answers, start = position, case, None
+        if isinstance(answers, list) and (start is None or isinstance(start, str)) \
+                and all(isinstance(answer, (str, int)) and not isinstance(answer, bool) for answer in answers):
+            result = table.evaluate(answers, start)
+        else:
+            result = {'status': 'invalid_case'}
+        result['case'] = case_id
+        yield result
 
-        while queue:
-            current_id, path = queue.popleft()
-            current_node = entity_store.entities[current_id].to_dict()
-            current_path = [current_node] + path
 
-            if current_id not in parent_map:
-                paths.append(current_path)
-            else:
-                for parent_id in parent_map[current_id]:
-                    queue.append((parent_id, current_path))
+def find_paths_to_node(store, target_id, limit=MAX_PATHS, max_depth=None):
+    """
+    Returns up to `limit` root-to-node paths as lists of node dicts, shortest
+    first, and whether more paths exist. When the limit is hit the paths are
+    the first ones found, not necessarily the shortest.
+    """
+    node_dicts = {}
 
-        return paths
+    def to_dict(node_id):
+        if node_id not in node_dicts:
+            node_dicts[node_id] = store.entities[node_id].to_dict()
+        return node_dicts[node_id]
 
-    return bfs()
+    paths = list(islice(iter_paths_to_node(store, target_id, max_depth), None if limit is None else limit + 1))
+    truncated = limit is not None and len(paths) > limit
+    paths = sorted(paths[:limit], key=len)
+    return [[to_dict(node_id) for node_id in path] for path in paths], truncated
 
 
 if __name__ == "__main__":
+    # ingest imports this module as `app`; without the alias a script run
+    # would load a second copy of it with its own registry and metrics.
+    sys.modules.setdefault("app", sys.modules[__name__])
     app.run(debug=True)
@@ -0,0 +1,182 @@
+"""
+Generates synthetic CmapTools XTM topic maps for benchmarks.
+
+Maps are written in the same format as the sample trees: concept and
+linkingPhrase topics with file occurrences, joined by parent/link/child
+associations. The shape is either a tree with a fixed fan-out or a DAG in
+which some nodes get an extra parent that appears earlier in the map, so
+the result stays acyclic. Optionally writes the tree folder with images,
+texts and a description, and packs it into an upload archive:
+
+    python benchmarks/generate_map.py out/ --name bench --nodes 50000 --shape dag --images 200 --zip
+"""
+import argparse
+import io
+import os
+import random
+import shutil
+import subprocess
+import zipfile
+
+XTM_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+              '<topicMap id="bench" xmlns="http://www.topicmaps.org/xtm/1.0/" '
+              'xmlns:xlink="http://www.w3.org/1999/xlink">\n')
+TOPIC = ('<topic id="{id}"><instanceOf><subjectIndicatorRef xlink:type="simple" '
+         'xlink:href="http://cmap.coginst.uwf.edu/#{kind}"/></instanceOf>'
+         '<baseName><baseNameString><![CDATA[{label}]]></baseNameString></baseName>{occurrences}</topic>\n')
+OCCURRENCE = '<occurrence><resourceRef xlink:type="simple" xlink:href="file:/./{folder}/{file}"/></occurrence>'
+ASSOCIATION = ('<association id="assoc_{link}"><instanceOf><topicRef xlink:type="simple" xlink:href="#{link}"/>'
+               '</instanceOf><member><topicRef xlink:type="simple" xlink:href="#{parent}"/></member>'
+               '<member><topicRef xlink:type="simple" xlink:href="#{child}"/></member></association>\n')
+SHAPES = ('tree', 'dag')
+
+
+def node_id(index):
+    return f"20C4S3YGF-{index:07X}-FT"
+
+
+def image_name(index):
+    return f"image{index}.png"
+
+
+def text_name(index):
+    return f"text{index}.txt"
+
+
+def iter_edges(nodes, shape='tree', fanout=3, extra_parents=0.1, seed=0):
+    """
+    Yields (parent, child) node indexes. Node 0 is the root and every
+    other node has the parent (index - 1) // fanout; in a DAG a share
+    `extra_parents` of the nodes also gets a random earlier parent.
+    """
+    if shape not in SHAPES:
+        raise ValueError(f"Unknown shape '{shape}'")
+    rng = random.Random(seed)
+    for index in range(1, nodes):
+        parent = (index - 1) // fanout
+        yield parent, index
+        if shape == 'dag' and index > 1 and rng.random() < extra_parents:
+            extra = rng.randrange(index)
+            if extra != parent:
+                yield extra, index
+
+
+def write_map(path, nodes, shape='tree', fanout=3, extra_parents=0.1, images=0, texts=0, folder='bench', seed=0):
+    """
+    Writes an XTM map with `nodes` concepts. The first `images` concepts
+    reference an image and the first `texts` concepts a description text
+    inside `folder`. Returns the number of edges.
+    """
+    edges = 0
+    with open(path, 'w') as file:
+        file.write(XTM_HEADER)
+        for index in range(nodes):
+            occurrences = ''
+            if index < images:
+                occurrences += OCCURRENCE.format(folder=folder, file=image_name(index))
+            if index < texts:
+                occurrences += OCCURRENCE.format(folder=folder, file=text_name(index))
+            file.write(TOPIC.format(id=node_id(index), kind='concept', label=f"Question {index}?",
+                                    occurrences=occurrences))
+        for edge, (parent, child) in enumerate(iter_edges(nodes, shape, fanout, extra_parents, seed), 1):
+            link = f"LINK{edge:07X}"
+            file.write(TOPIC.format(id=link, kind='linkingPhrase', label=f"Answer {edge}", occurrences=''))
+            file.write(ASSOCIATION.format(link=link, parent=node_id(parent), child=node_id(child)))
+            edges = edge
+        file.write('</topicMap>\n')
+    return edges
+
+
+def write_image(path, index, size=256):
+    from PIL import Image
+
+    color = ((index * 67) % 256, (index * 151) % 256, (index * 29) % 256)
+    Image.new('RGB', (size, size), color).save(path)
+
+
+def write_tree_folder(root, name, nodes, images=0, texts=0, **options):
+    """
+    Writes a complete tree folder `root/name` with the map, its images and
+    texts and a description.txt, like an extracted upload. Returns the
+    folder path.
+    """
+    folder = os.path.join(root, name)
+    os.makedirs(os.path.join(folder, 'images'), exist_ok=True)
+    os.makedirs(os.path.join(folder, 'texts'), exist_ok=True)
+    write_map(os.path.join(folder, f"{name}.xml"), nodes, images=images, texts=texts, folder=name, **options)
+    for index in range(images):
+        write_image(os.path.join(folder, 'images', image_name(index)), index)
+    for index in range(texts):
+        with open(os.path.join(folder, 'texts', text_name(index)), 'w') as file:
+            file.write(f"Description of question {index}. " * 20)
+    with open(os.path.join(folder, 'description.txt'), 'w') as file:
+        file.write(f"Synthetic {options.get('shape', 'tree')} with {nodes} nodes")
+    return folder
+
+
+def archive_members(folder):
+    """
+    Yields (archive name, path) for the files of a tree folder in the layout
+    uploads use: the map and description at the top, assets in subfolders.
+    """
+    for root, _, files in os.walk(folder):
+        for file_name in sorted(files):
+            if file_name.startswith('.'):
+                continue
+            path = os.path.join(root, file_name)
+            yield os.path.relpath(path, folder).replace(os.sep, '/'), path
+
+
+def zip_tree_folder(folder):
+    """
+    Returns the tree folder packed as ZIP archive bytes.
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, path in archive_members(folder):
+            archive.write(path, name)
+    return buffer.getvalue()
+
+
+def rar_tree_folder(folder, path):
+    """
+    Packs the tree folder into the RAR archive `path` with the external rar
+    tool. Returns False when rar is not installed.
+    """
+    rar = shutil.which('rar')
+    if rar is None:
+        return False
+    subprocess.run([rar, 'a', '-idq', '-r', os.path.abspath(path), '.'], cwd=folder, check=True)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('output', help="directory the tree folder is written into")
+    parser.add_argument('--name', default='bench')
+    parser.add_argument('--nodes', type=int, default=20000)
+    parser.add_argument('--shape', choices=SHAPES, default='tree')
+    parser.add_argument('--fanout', type=int, default=3)
+    parser.add_argument('--extra-parents', type=float, default=0.1)
+    parser.add_argument('--images', type=int, default=0)
+    parser.add_argument('--texts', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--zip', action='store_true', help="also write <name>.zip next to the folder")
+    parser.add_argument('--rar', action='store_true', help="also write <name>.rar next to the folder")
+    args = parser.parse_args()
+
+    folder = write_tree_folder(args.output, args.name, args.nodes, images=args.images, texts=args.texts,
+                               shape=args.shape, fanout=args.fanout, extra_parents=args.extra_parents,
+                               seed=args.seed)
+    print(folder)
+    if args.zip:
+        with open(os.path.join(args.output, f"{args.name}.zip"), 'wb') as file:
+            file.write(zip_tree_folder(folder))
+        print(os.path.join(args.output, f"{args.name}.zip"))
+    if args.rar:
+        path = os.path.join(args.output, f"{args.name}.rar")
+        print(path if rar_tree_folder(folder, path) else "rar is not installed, skipped the RAR archive")
+
+
+if __name__ == "__main__":
+    main()
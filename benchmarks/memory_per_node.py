@@ -0,0 +1,55 @@
+"""
+Measures how many bytes a built EntityStore holds per concept node.
+
+Writes a synthetic XTM map with the requested number of concepts, parses
+and builds it with tracemalloc running and prints the retained bytes per
+node. Run it on two commits to compare node representations:
+
+    python benchmarks/memory_per_node.py --nodes 20000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import EntityStore  # noqa: E402
+from generate_map import write_map  # noqa: E402
+
+
+def measure(nodes):
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'bench.xml')
+        write_map(path, nodes)
+
+        gc.collect()
+        tracemalloc.start()
+        store = EntityStore()
+        store.parse_xtm_file(path)
+        store.build_decision_tree()
+        gc.collect()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del store
+
+    return {
+        'nodes': nodes,
+        'retained_bytes': retained,
+        'peak_bytes': peak,
+        'bytes_per_node': round(retained / nodes, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--nodes', type=int, default=20000)
+    args = parser.parse_args()
+    print(json.dumps(measure(args.nodes), indent=2))
+
+
+if __name__ == "__main__":
+    main()
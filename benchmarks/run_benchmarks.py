@@ -0,0 +1,247 @@
+"""
+Benchmarks the tree hot paths and writes the results as JSON.
+
+Generates a synthetic map with generate_map, then times parsing,
+build_decision_tree, create_node, find_paths_to_node and
+generate_tree_ascii directly, and the matching endpoints plus the ZIP and
+RAR upload paths through Flask's test client. Every stage reports latency
+percentiles and, from a separate tracemalloc pass, its memory peak. Save
+one result per commit and compare them:
+
+    python benchmarks/run_benchmarks.py --nodes 20000 --output before.json
+    python benchmarks/run_benchmarks.py --nodes 20000 --output after.json --compare before.json
+"""
+import argparse
+import datetime
+import gc
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from generate_map import SHAPES, node_id, rar_tree_folder, write_tree_folder, zip_tree_folder  # noqa: E402
+
+TREE_NAME = 'bench'
+UPLOAD_NAME = 'benchupload'
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    result = {
+        'count': len(samples),
+        'mean_ms': round(statistics.fmean(samples) * 1000, 4),
+        'p50_ms': round(statistics.median(samples) * 1000, 4),
+        'max_ms': round(samples[-1] * 1000, 4),
+    }
+    if len(samples) > 1:
+        percentiles = statistics.quantiles(samples, n=100, method='inclusive')
+        result['p90_ms'] = round(percentiles[89] * 1000, 4)
+        result['p99_ms'] = round(percentiles[98] * 1000, 4)
+    return result
+
+
+def timed(calls, setup=None):
+    """
+    Runs each call in `calls` once and returns the per-call seconds.
+    `setup`, when given, runs untimed before every call.
+    """
+    samples = []
+    for call in calls:
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def memory_peak(calls, setup=None):
+    """
+    Returns the tracemalloc peak in bytes while running `calls` once more.
+    """
+    if setup is not None:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    try:
+        for call in calls:
+            call()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def stage(calls, setup=None):
+    calls = list(calls)
+    result = summarize(timed(calls, setup))
+    result['peak_bytes'] = memory_peak(calls[:1] if setup else calls, setup)
+    return result
+
+
+def checked(response, status=200):
+    if response.status_code != status:
+        raise RuntimeError(f"{response.request.path} returned {response.status_code}: {response.get_data(True)[:200]}")
+    return response
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args, workdir):
+    sources = os.path.join(workdir, 'sources')
+    trees = os.path.join(workdir, 'trees')
+    os.makedirs(sources)
+    os.makedirs(trees)
+    shape = {'shape': args.shape, 'fanout': args.fanout, 'extra_parents': args.extra_parents, 'seed': args.seed}
+    folder = write_tree_folder(trees, TREE_NAME, args.nodes, images=args.images, texts=args.texts, **shape)
+    xml_path = os.path.join(TREE_NAME, f"{TREE_NAME}.xml")
+    upload_folder = write_tree_folder(sources, UPLOAD_NAME, args.upload_nodes, images=args.upload_images,
+                                      texts=args.upload_images, **shape)
+
+    # The app resolves tree folders against the working directory.
+    os.chdir(trees)
+    import app as application
+    from app import EntityStore, create_node, find_paths_to_node, generate_tree_ascii
+
+    application.app.root_path = trees
+    client = application.app.test_client()
+    rng = random.Random(args.seed)
+    sample = [node_id(index) for index in rng.sample(range(args.nodes), min(args.samples, args.nodes))]
+    stages = {}
+
+    def parse():
+        store = EntityStore()
+        store.parse_xtm_file(xml_path)
+        return store
+
+    stages['parse'] = stage([parse] * args.repeat)
+
+    parsed = []
+    stages['build_decision_tree'] = stage([lambda: parsed[-1].build_decision_tree()] * args.repeat,
+                                          setup=lambda: parsed.append(parse()))
+    store = parsed[-1]
+    parsed.clear()
+
+    stages['create_node'] = stage(lambda node=node: create_node(store, node) for node in sample)
+    stages['find_paths_to_node'] = stage(lambda node=node: find_paths_to_node(store, node) for node in sample)
+    stages['generate_tree_ascii'] = stage([lambda: generate_tree_ascii(store)] * args.repeat)
+    del store
+
+    checked(client.get('/api/tree', query_string={'name': TREE_NAME}))
+    stages['api_tree'] = stage(
+        [lambda: checked(client.get('/api/tree', query_string={'name': TREE_NAME}))] * args.repeat)
+    stages['api_get_children'] = stage(
+        lambda node=node: checked(client.get('/api/get_children', query_string={'name': TREE_NAME, 'node': node}))
+        for node in sample)
+    stages['api_get_path'] = stage(
+        lambda node=node: checked(client.get('/api/get_path', query_string={'name': TREE_NAME, 'node': node}))
+        for node in sample)
+    stages['api_tree_ascii'] = stage(
+        [lambda: checked(client.get('/api/tree_ascii', query_string={'name': TREE_NAME}))] * args.repeat)
+
+    def delete_upload():
+        if os.path.isdir(UPLOAD_NAME):
+            checked(client.delete('/api/tree/delete', query_string={'name': UPLOAD_NAME}))
+
+    def upload(data, file_name):
+        return lambda: checked(client.post('/api/load_tree', content_type='multipart/form-data',
+                                           data={'file': (io.BytesIO(data), file_name)}))
+
+    zip_data = zip_tree_folder(upload_folder)
+    stages['upload_zip'] = stage([upload(zip_data, f"{UPLOAD_NAME}.zip")] * args.upload_repeat, setup=delete_upload)
+    rar_path = os.path.join(sources, f"{UPLOAD_NAME}.rar")
+    if rar_tree_folder(upload_folder, rar_path):
+        with open(rar_path, 'rb') as file:
+            rar_data = file.read()
+        stages['upload_rar'] = stage([upload(rar_data, f"{UPLOAD_NAME}.rar")] * args.upload_repeat,
+                                     setup=delete_upload)
+    else:
+        stages['upload_rar'] = {'skipped': "rar is not installed"}
+    delete_upload()
+
+    return {
+        'commit': git_commit(),
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'nodes': args.nodes, 'images': args.images, 'texts': args.texts, 'samples': len(sample),
+            'repeat': args.repeat, 'upload_nodes': args.upload_nodes, 'upload_images': args.upload_images,
+            'upload_repeat': args.upload_repeat, **shape
+        },
+        'tree_bytes': sum(os.path.getsize(os.path.join(root, name))
+                          for root, _, files in os.walk(folder) for name in files),
+        'stages': stages,
+    }
+
+
+def compare(results, baseline):
+    """
+    Prints the p50 and peak memory of every stage next to the baseline.
+    """
+    print(f"{'stage':<22}{'p50 ms':>12}{'baseline':>12}{'ratio':>8}{'peak MB':>10}{'baseline':>10}")
+    for name, current in results['stages'].items():
+        previous = baseline.get('stages', {}).get(name, {})
+        if 'p50_ms' not in current or 'p50_ms' not in previous:
+            print(f"{name:<22}{current.get('p50_ms', '-'):>12}{previous.get('p50_ms', '-'):>12}")
+            continue
+        ratio = current['p50_ms'] / previous['p50_ms'] if previous['p50_ms'] else float('inf')
+        print(f"{name:<22}{current['p50_ms']:>12.3f}{previous['p50_ms']:>12.3f}{ratio:>8.2f}"
+              f"{current['peak_bytes'] / 1e6:>10.2f}{previous['peak_bytes'] / 1e6:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--nodes', type=int, default=20000)
+    parser.add_argument('--shape', choices=SHAPES, default='tree')
+    parser.add_argument('--fanout', type=int, default=3)
+    parser.add_argument('--extra-parents', type=float, default=0.1)
+    parser.add_argument('--images', type=int, default=0)
+    parser.add_argument('--texts', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--samples', type=int, default=200, help="nodes sampled for per-node stages")
+    parser.add_argument('--repeat', type=int, default=5, help="runs of whole-tree stages")
+    parser.add_argument('--upload-nodes', type=int, default=2000)
+    parser.add_argument('--upload-images', type=int, default=20)
+    parser.add_argument('--upload-repeat', type=int, default=3)
+    parser.add_argument('--output', help="file the JSON results are written to, stdout by default")
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    workdir = tempfile.mkdtemp(prefix='tree-bench-')
+    try:
+        results = run(args, workdir)
+    finally:
+        os.chdir(REPO_ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    if baseline:
+        with open(baseline) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
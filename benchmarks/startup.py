@@ -0,0 +1,134 @@
+"""
+Measures worker startup and first-request latency and writes them as JSON.
+
+Every sample runs in a fresh interpreter, like a worker started without
+--preload: it imports app, then times the first /api/tree and
+/api/get_children requests for a synthetic tree. Scenarios:
+
+    import      importing app only, and which ingestion modules it pulled in
+    cold_parse  first requests with no compiled artifact, so the XML is parsed
+    cold        first requests attaching the compiled artifact
+    preloaded   warm_up_trees() first, as the gunicorn master does before forking
+
+    python benchmarks/startup.py --nodes 20000 --output startup.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from generate_map import SHAPES, write_tree_folder
+from run_benchmarks import REPO_ROOT, git_commit, summarize
+
+TREE_NAME = 'bench'
+SCENARIOS = ('import', 'cold_parse', 'cold', 'preloaded')
+INGESTION_MODULES = ('patoolib', 'PIL', 'zipfile', 'ingest')
+
+# Runs one sample and prints its timings as JSON. It is passed to `python -c`
+# rather than run from this file, whose own imports would hide what app loads.
+CHILD = """
+import json, sys, time
+scenario, tree, modules = sys.argv[1], sys.argv[2], sys.argv[3].split(',')
+started = time.perf_counter()
+import app as application
+result = {'import_s': time.perf_counter() - started,
+          'ingestion_modules': [name for name in modules if name in sys.modules]}
+if scenario != 'import':
+    if scenario == 'preloaded':
+        started = time.perf_counter()
+        application.warm_up_trees([tree])
+        result['warm_up_s'] = time.perf_counter() - started
+    client = application.app.test_client()
+    started = time.perf_counter()
+    response = client.get('/api/tree', query_string={'name': tree})
+    result['first_tree_s'] = time.perf_counter() - started
+    root = response.get_json()['root']['id']
+    started = time.perf_counter()
+    response = client.get('/api/get_children', query_string={'name': tree, 'node': root})
+    result['first_get_children_s'] = time.perf_counter() - started
+    assert response.status_code == 200, response.get_data(True)
+print(json.dumps(result))
+"""
+
+
+def reset_tree(trees, compiled):
+    """
+    Removes the recently used list and, unless `compiled`, every file the
+    app derives from the tree's XML.
+    """
+    recent = os.path.join(trees, '.recent_trees')
+    if os.path.exists(recent):
+        os.remove(recent)
+    if not compiled:
+        folder = os.path.join(trees, TREE_NAME)
+        for name in os.listdir(folder):
+            if name.startswith('.tree.'):
+                os.remove(os.path.join(folder, name))
+
+
+def sample(trees, scenario):
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [REPO_ROOT, os.environ.get('PYTHONPATH')])))
+    started = time.perf_counter()
+    command = [sys.executable, '-c', CHILD, scenario, TREE_NAME, ','.join(INGESTION_MODULES)]
+    completed = subprocess.run(command, cwd=trees, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"{scenario} sample failed:\n{completed.stderr}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result['process_s'] = time.perf_counter() - started
+    return result
+
+
+def run(args, trees):
+    write_tree_folder(trees, TREE_NAME, args.nodes, texts=args.texts, shape=args.shape, seed=args.seed)
+    scenarios = {}
+    for scenario in SCENARIOS:
+        samples = []
+        for _ in range(args.repeat):
+            reset_tree(trees, compiled=scenario != 'cold_parse')
+            samples.append(sample(trees, scenario))
+        timings = {key: summarize([entry[key] for entry in samples])
+                   for key in samples[0] if key.endswith('_s')}
+        scenarios[scenario] = {'ingestion_modules': samples[0]['ingestion_modules'], **timings}
+
+    return {
+        'commit': git_commit(),
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {'nodes': args.nodes, 'texts': args.texts, 'shape': args.shape, 'seed': args.seed,
+                   'repeat': args.repeat},
+        'scenarios': scenarios,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--nodes', type=int, default=20000)
+    parser.add_argument('--shape', choices=SHAPES, default='tree')
+    parser.add_argument('--texts', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5, help="fresh processes per scenario")
+    parser.add_argument('--output', help="file the JSON results are written to, stdout by default")
+    args = parser.parse_args()
+
+    trees = tempfile.mkdtemp(prefix='tree-startup-')
+    try:
+        results = run(args, trees)
+    finally:
+        shutil.rmtree(trees, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
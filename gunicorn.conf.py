@@ -0,0 +1,39 @@
+"""
+Gunicorn settings for serving the app:
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+With preload_app the master imports the app and loads the hot trees (see
+warm_up_trees) once, then forks; every worker starts with them resident and
+the pages stay shared copy-on-write. gc.freeze() moves the preloaded objects
+out of the collector's reach, so collections in the workers do not touch and
+copy those pages. Without preload_app each worker warms up after the fork.
+"""
+import gc
+import os
+import time
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_class = os.environ.get("WORKER_CLASS", "sync")
+preload_app = os.environ.get("PRELOAD_APP", "true").lower() in ("1", "true")
+
+
+def warm_up(log):
+    from app import warm_up_trees
+
+    started = time.perf_counter()
+    names = warm_up_trees()
+    log.info(f"Preloaded {len(names)} trees in {time.perf_counter() - started:.2f}s: {', '.join(names)}")
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        warm_up(server.log)
+        gc.collect()
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if not server.cfg.preload_app:
+        warm_up(worker.log)
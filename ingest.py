@@ -0,0 +1,454 @@
+"""
+Tree upload ingestion: archive extraction, image recompression and the
+background upload jobs.
+
+Only /api/load_tree and image variants that are not on disk yet need this
+module, so app imports it on first use and workers that only serve trees
+never import patoolib or Pillow.
+"""
+import io
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import patoolib
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from werkzeug.exceptions import BadRequest, Conflict, HTTPException, RequestEntityTooLarge, UnsupportedMediaType
+
+from app import IMAGE_DERIVATIVE_WIDTHS, JOBS_FOLDER, RASTER_IMAGE_EXTENSIONS, STAGING_FOLDER, UploadJob, \
+    app, hash_file, image_variant_path, metrics, tree_catalog, tree_exists, tree_registry
+
+IMAGE_WORKERS = int(os.environ.get("IMAGE_WORKERS", os.cpu_count() or 1))
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 2))
+UPLOAD_JOB_RETENTION_SECONDS = 3600
+UPLOAD_STAGE_PROGRESS = {'parsing': 0.6, 'building': 0.8}
+MAX_ARCHIVE_ENTRIES = int(os.environ.get("MAX_ARCHIVE_ENTRIES", 10000))
+MAX_ARCHIVE_BYTES = int(os.environ.get("MAX_ARCHIVE_BYTES", 1024 * 1024 * 1024))
+RAR_LIST_TIMEOUT_SECONDS = 60
+UPLOADS_FOLDER = os.path.join(STAGING_FOLDER, "uploads")
+
+upload_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="upload")
+
+_image_pool = None
+_image_pool_lock = threading.Lock()
+
+
+def get_image_pool():
+    global _image_pool
+    with _image_pool_lock:
+        if _image_pool is None:
+            _image_pool = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+        return _image_pool
+
+
+def recompress_image(source, new_path):
+    """
+    Decodes `source` (image bytes or a file path), writes the recompressed
+    image to `new_path` and generates its derivatives next to it. Runs
+    inside the image process pool.
+    """
+    started = time.perf_counter()
+    with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+        img.load()
+        save_image(img, new_path)
+        content_hash = hash_file(new_path)
+        for width in IMAGE_DERIVATIVE_WIDTHS:
+            for webp in (False, True):
+                write_image_variant(img, image_variant_path(new_path, content_hash, width, webp), width)
+        write_image_variant(img, image_variant_path(new_path, content_hash, None, True), None)
+    return os.path.basename(new_path), time.perf_counter() - started
+
+
+def save_image(img, path):
+    """
+    Encodes `img` in the format implied by `path`. Only lossy formats get
+    a quality setting; PNG is losslessly optimized.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.jpg', '.jpeg'):
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        img.save(path, 'JPEG', optimize=True, quality=80)
+    elif extension == '.webp':
+        img.save(path, 'WEBP', quality=80, method=4)
+    else:
+        img.save(path, optimize=True)
+
+
+def write_image_variant(img, variant_path, width):
+    """
+    Writes `img` bounded to `width` pixels (never upscaled) to `variant_path`
+    through a temporary file, so concurrent readers never see a partial image.
+    """
+    if width is not None and img.width > width:
+        img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS)
+    os.makedirs(os.path.dirname(variant_path), exist_ok=True)
+    root, extension = os.path.splitext(variant_path)
+    temp_path = f"{root}.{os.getpid()}.{threading.get_ident()}.tmp{extension}"
+    save_image(img, temp_path)
+    os.replace(temp_path, variant_path)
+
+
+def create_image_variant(path, variant_path, width):
+    """
+    Generates the variant `variant_path` of the image at `path` on demand.
+    """
+    with Image.open(path) as img:
+        img.load()
+        write_image_variant(img, variant_path, width)
+
+
+def collect_image_timings(pending_images):
+    timings = []
+    for future in pending_images:
+        file_name, seconds = future.result()
+        metrics.observe('tree_stage_duration_seconds', seconds, stage='image_encode')
+        timings.append({"file": file_name, "seconds": round(seconds, 4)})
+    return timings
+
+
+class TreeStaging:
+    """
+    Private folder under STAGING_FOLDER that one upload writes its tree into.
+    Members land directly in their final place inside it and the finished
+    folder is renamed into the tree root, so readers never see a partial tree
+    and concurrent uploads never share files.
+    """
+
+    def __init__(self):
+        os.makedirs(STAGING_FOLDER, exist_ok=True)
+        self.path = tempfile.mkdtemp(dir=STAGING_FOLDER)
+        self.scratch = os.path.join(self.path, '.scratch')
+        self.images_folder = os.path.join(self.path, 'images')
+        self.texts_folder = os.path.join(self.path, 'texts')
+        os.makedirs(self.scratch)
+        os.makedirs(self.images_folder)
+        os.makedirs(self.texts_folder)
+
+    def member_path(self, name):
+        """
+        Returns where the archive member `name` belongs inside the tree
+        folder. The XML file, description.txt and tree_graph files sit at
+        the top level, texts under texts/ and everything else under images/.
+        """
+        file_name = os.path.basename(name)
+        if file_name.endswith('.xml') or file_name == 'description.txt' or file_name.startswith('tree_graph'):
+            return os.path.join(self.path, file_name)
+        if file_name.endswith(('.txt', '.htm', '.html')):
+            return os.path.join(self.texts_folder, file_name)
+        return os.path.join(self.images_folder, file_name)
+
+    def publish(self, folder_name):
+        shutil.rmtree(self.scratch, ignore_errors=True)
+        if tree_exists(folder_name):
+            raise tree_conflict(folder_name)
+        try:
+            os.rename(self.path, folder_name)
+        except OSError:
+            raise tree_conflict(folder_name)
+
+    def discard(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def tree_conflict(folder_name):
+    return Conflict(
+        f"A tree with the name '{folder_name}' already exists. Please choose a different name or delete the existing tree first.")
+
+
+def check_archive_limits(sizes):
+    """
+    Rejects an archive whose member count or total uncompressed size is
+    over MAX_ARCHIVE_ENTRIES or MAX_ARCHIVE_BYTES.
+    """
+    if len(sizes) > MAX_ARCHIVE_ENTRIES:
+        raise RequestEntityTooLarge(f"The archive has more than {MAX_ARCHIVE_ENTRIES} entries")
+    if sum(sizes) > MAX_ARCHIVE_BYTES:
+        raise RequestEntityTooLarge(f"The archive expands to more than {MAX_ARCHIVE_BYTES} bytes")
+
+
+def parse_unrar_listing(listing):
+    """
+    Returns the uncompressed sizes of the files in a listing by RARLAB's
+    `unrar lt`, leaving out directories. Other programs installed as unrar,
+    such as unrar-free, print something else and get an empty list.
+    """
+    if 'Alexander Roshal' not in listing:
+        return []
+    sizes, member_type = [], None
+    for line in listing.splitlines():
+        key, _, value = line.strip().partition(': ')
+        if key == 'Type':
+            member_type = value
+        elif key == 'Size' and member_type != 'Directory':
+            sizes.append(int(value))
+    return sizes
+
+
+def parse_7z_listing(listing):
+    """
+    Returns the sizes of the files in a `7z l -slt` listing, whose entries
+    follow the archive's own properties after a line of dashes.
+    """
+    sizes, entry = [], {}
+    for line in listing.partition('\n----------\n')[2].splitlines() + ['']:
+        key, _, value = line.partition(' = ')
+        if line:
+            entry[key] = value
+            continue
+        if 'Path' in entry and entry.get('Folder') != '+':
+            sizes.append(int(entry.get('Size') or 0))
+        entry = {}
+    return sizes
+
+
+def parse_lsar_listing(listing):
+    """
+    Returns the sizes of the files in the JSON listing of unar's `lsar -j`.
+    """
+    try:
+        entries = json.loads(listing)['lsarContents']
+    except (ValueError, KeyError, TypeError):
+        return []
+    return [int(entry.get('XADFileSize', 0)) for entry in entries if not entry.get('XADIsDirectory')]
+
+
+def parse_bsdtar_listing(listing):
+    """
+    Returns the sizes of the files in a `bsdtar -tvf` listing, the fifth
+    column of its ls-style lines.
+    """
+    sizes = []
+    for line in listing.splitlines():
+        fields = line.split(None, 8)
+        if len(fields) == 9 and not line.startswith('d') and fields[4].isdigit():
+            sizes.append(int(fields[4]))
+    return sizes
+
+
+# The programs patool can extract RAR archives with, each with the command
+# listing an archive's members and the parser for that listing.
+RAR_LISTERS = (
+    ('unrar', ('lt', '-p-', '-c-'), parse_unrar_listing),
+    ('7z', ('l', '-slt'), parse_7z_listing),
+    ('7zz', ('l', '-slt'), parse_7z_listing),
+    ('lsar', ('-j',), parse_lsar_listing),
+    ('bsdtar', ('-tvf',), parse_bsdtar_listing),
+)
+
+
+def list_rar_sizes(archive_path):
+    """
+    Reads the member sizes of a RAR archive from its headers, without
+    extracting anything, with the first installed program that lists it.
+    """
+    installed = False
+    for program, arguments, parse in RAR_LISTERS:
+        executable = shutil.which(program)
+        if executable is None:
+            continue
+        installed = True
+        try:
+            completed = subprocess.run([executable, *arguments, archive_path], capture_output=True, text=True,
+                                       stdin=subprocess.DEVNULL, timeout=RAR_LIST_TIMEOUT_SECONDS)
+        except subprocess.TimeoutExpired:
+            continue
+        sizes = parse(completed.stdout) if completed.returncode == 0 else []
+        if sizes:
+            return sizes
+    if not installed:
+        raise UnsupportedMediaType("RAR uploads are not supported on this server")
+    raise BadRequest("The RAR could not be read")
+
+
+def copy_limited(source, destination, limit, chunk_size=1024 * 1024):
+    """
+    Copies the stream `source` into the file `destination`, failing once
+    more than `limit` bytes were read.
+    """
+    copied = 0
+    with open(destination, 'wb') as out:
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return copied
+            copied += len(chunk)
+            if copied > limit:
+                raise RequestEntityTooLarge(f"The archive is larger than {limit} bytes")
+            out.write(chunk)
+
+
+def extract_files(file):
+    """
+    Extracts an uploaded ZIP or RAR tree archive into a new tree folder.
+    Returns the XML file name, the folder name and per-image timings.
+    """
+    file_extension = os.path.splitext(file.filename)[1].lower()
+    if file_extension not in ('.zip', '.rar'):
+        raise BadRequest('Unsupported file type. Only ZIP and RAR are supported.')
+
+    staging = TreeStaging()
+    pending_images = []
+    try:
+        with metrics.timer('extract'):
+            if file_extension == '.zip':
+                with zipfile.ZipFile(file, 'r') as zip_ref:
+                    xml_filename = _extract_from_zip(zip_ref, staging, pending_images)
+            else:
+                xml_filename = _extract_from_rar(file, staging, pending_images)
+        image_timings = collect_image_timings(pending_images)
+
+        folder_name = os.path.splitext(xml_filename)[0]
+        staging.publish(folder_name)
+        return xml_filename, folder_name, image_timings
+    finally:
+        wait(pending_images)
+        staging.discard()
+
+
+def _find_tree_xml(names):
+    xml_files = [name for name in names if name.endswith('.xml')]
+    if not xml_files:
+        return None
+    xml_filename = os.path.basename(xml_files[0])
+    folder_name = os.path.splitext(xml_filename)[0]
+    if tree_exists(folder_name):
+        raise tree_conflict(folder_name)
+    return xml_files[0]
+
+
+def _place_member(staging, name, source, pending_images):
+    """
+    Writes one archive member to its place in the staging folder. `source`
+    returns the member as bytes for raster images, which are recompressed in
+    the image pool, and as an open binary stream otherwise.
+    """
+    target = staging.member_path(name)
+    if target.endswith(RASTER_IMAGE_EXTENSIONS) and os.path.dirname(target) == staging.images_folder:
+        pending_images.append(get_image_pool().submit(recompress_image, source(True), target))
+        return
+    with source(False) as stream, open(target, 'wb') as out:
+        shutil.copyfileobj(stream, out, 1024 * 1024)
+
+
+def _extract_from_zip(zip_ref, staging, pending_images):
+    members = [info for info in zip_ref.infolist() if not info.is_dir()]
+    check_archive_limits([info.file_size for info in members])
+
+    xml_member = _find_tree_xml([info.filename for info in members])
+    if xml_member is None:
+        raise BadRequest('No XML files found in the zip')
+    xml_filename = os.path.basename(xml_member)
+
+    for info in members:
+        if info.filename.endswith('.xml') and info.filename != xml_member:
+            continue
+        _place_member(staging, info.filename,
+                      lambda as_bytes, info=info: zip_ref.read(info) if as_bytes else zip_ref.open(info),
+                      pending_images)
+    return xml_filename
+
+
+def _extract_from_rar(file, staging, pending_images):
+    # RAR members can only be read through the external unrar tools, so the
+    # archive is unpacked once into the staging scratch folder and each
+    # member is then moved, not copied, to its place on the same filesystem.
+    # The limits are checked against the listed sizes before anything is
+    # unpacked, and again against what was actually written.
+    archive_path = os.path.join(staging.scratch, 'upload.rar')
+    copy_limited(file.stream, archive_path, MAX_ARCHIVE_BYTES)
+    check_archive_limits(list_rar_sizes(archive_path))
+    unpacked = os.path.join(staging.scratch, 'unpacked')
+    os.makedirs(unpacked)
+    patoolib.extract_archive(archive_path, outdir=unpacked, verbosity=-1, interactive=False)
+
+    members = []
+    for root, _, files in os.walk(unpacked):
+        members.extend(os.path.join(root, f) for f in files)
+    check_archive_limits([os.path.getsize(member) for member in members])
+
+    xml_member = _find_tree_xml(members)
+    if xml_member is None:
+        raise BadRequest('No XML files found in the RAR')
+    xml_filename = os.path.basename(xml_member)
+
+    for member in members:
+        if member.endswith('.xml') and member != xml_member:
+            continue
+        target = staging.member_path(member)
+        if target.endswith(RASTER_IMAGE_EXTENSIONS) and os.path.dirname(target) == staging.images_folder:
+            pending_images.append(get_image_pool().submit(recompress_image, member, target))
+        else:
+            os.replace(member, target)
+    return xml_filename
+
+
+def submit_upload_job(upload):
+    """
+    Streams `upload` into the staging folder, failing once it is larger than
+    MAX_ARCHIVE_BYTES, and queues a job extracting and loading it.
+    """
+    remove_expired_jobs()
+    job = UploadJob(upload.filename)
+    os.makedirs(UPLOADS_FOLDER, exist_ok=True)
+    upload_path = os.path.join(UPLOADS_FOLDER, job.id + os.path.splitext(upload.filename)[1].lower())
+    try:
+        copy_limited(upload.stream, upload_path, MAX_ARCHIVE_BYTES)
+    except BaseException:
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+        raise
+    job.save()
+    upload_executor.submit(run_upload_job, job, upload_path)
+    return job
+
+
+def remove_expired_jobs():
+    """
+    Deletes the saved state and uploads of jobs not updated for
+    UPLOAD_JOB_RETENTION_SECONDS, including jobs whose worker died.
+    """
+    expired = time.time() - UPLOAD_JOB_RETENTION_SECONDS
+    for folder in (JOBS_FOLDER, UPLOADS_FOLDER):
+        if not os.path.isdir(folder):
+            continue
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime < expired:
+                        os.remove(entry.path)
+                except OSError:
+                    pass
+
+
+def run_upload_job(job, upload_path):
+    try:
+        job.update('extracting', 0.1)
+        with open(upload_path, 'rb') as stream:
+            xml_file, folder, _ = extract_files(FileStorage(stream, filename=job.filename))
+        xml_path = os.path.join(folder, xml_file)
+        job.tree = folder
+
+        store = tree_registry.load(folder, xml_path, use_snapshot=False,
+                                   on_stage=lambda stage: job.update(stage, UPLOAD_STAGE_PROGRESS[stage]))
+        tree_catalog.update(folder)
+
+        job.root = store.root_id
+        job.finish()
+    except HTTPException as e:
+        job.finish(e.description)
+    except Exception as e:
+        app.logger.error(f"Error in upload job {job.id}: {str(e)}")
+        job.finish("An unexpected error occurred")
+    finally:
+        try:
+            os.remove(upload_path)
+        except OSError:
+            pass
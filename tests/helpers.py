@@ -0,0 +1,21 @@
+TOPIC = ('<topic id="{id}"><instanceOf><subjectIndicatorRef xlink:type="simple" '
+         'xlink:href="http://cmap.coginst.uwf.edu/#{kind}"/></instanceOf>'
+         '<baseName><baseNameString><![CDATA[{label}]]></baseNameString></baseName></topic>\n')
+ASSOCIATION = ('<association id="assoc_{link}"><instanceOf><topicRef xlink:type="simple" xlink:href="#{link}"/>'
+               '</instanceOf><member><topicRef xlink:type="simple" xlink:href="#{parent}"/></member>'
+               '<member><topicRef xlink:type="simple" xlink:href="#{child}"/></member></association>\n')
+
+
+def map_xml(nodes, edges):
+    """
+    Returns an XTM map with the concepts `nodes` ({id: label}) joined by
+    one linking phrase per (parent, child) pair in `edges`.
+    """
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<topicMap id="test" xmlns="http://www.topicmaps.org/xtm/1.0/" '
+             'xmlns:xlink="http://www.w3.org/1999/xlink">\n']
+    parts.extend(TOPIC.format(id=node_id, kind='concept', label=label) for node_id, label in nodes.items())
+    for number, (parent, child) in enumerate(edges):
+        parts.append(TOPIC.format(id=f"L{number}", kind='linkingPhrase', label=f"Answer {number}"))
+        parts.append(ASSOCIATION.format(link=f"L{number}", parent=parent, child=child))
+    parts.append('</topicMap>\n')
+    return ''.join(parts)
@@ -0,0 +1,284 @@
+"""
+Request handling of the tree endpoints through Flask's test client.
+"""
+import io
+import os
+import time
+import zipfile
+
+import pytest
+
+import app
+from helpers import map_xml
+
+NODES = {'A': "Root?", 'B': "Left?", 'C': "Right?"}
+EDGES = [('A', 'B'), ('A', 'C')]
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app, 'tree_registry', app.TreeRegistry())
+    for name in ('first', 'second'):
+        os.makedirs(name)
+        with open(os.path.join(name, f"{name}.xml"), 'w') as file:
+            file.write(map_xml(NODES, EDGES))
+    return app.app.test_client()
+
+
+@pytest.mark.parametrize('method, url', [
+    ('get', '/api/get_children?node=A'),
+    ('get', '/api/get_path?node=B'),
+    ('get', '/api/tree_ascii'),
+    ('get', '/api/description?node=A'),
+    ('get', '/api/tree_export'),
+    ('post', '/api/evaluate'),
+])
+def test_tree_endpoints_require_a_name(client, method, url):
+    client.get('/api/tree', query_string={'name': 'first'})
+    client.get('/api/tree', query_string={'name': 'second'})
+    response = getattr(client, method)(url, json=[["Answer 0"]] if method == 'post' else None)
+    assert response.status_code == 400
+
+
+def test_get_children_uses_the_named_tree(client):
+    response = client.get('/api/get_children', query_string={'name': 'first', 'node': 'A'})
+    assert response.status_code == 200
+    assert [child['question']['id'] for child in response.get_json()['children']] == ['B', 'C']
+
+
+def test_evaluate_reports_unhashable_answers_per_case(client):
+    cases = [["Answer 0"], ["Answer 1", "x"], [{"a": 1}], {"answers": [["nested"]]}]
+    response = client.post('/api/evaluate', query_string={'name': 'first'}, json=cases)
+    assert response.status_code == 200
+    statuses = [result['status'] for result in response.get_json()['results']]
+    assert statuses == ['complete', 'invalid_answer', 'invalid_case', 'invalid_case']
+
+
+def test_evaluate_stream_survives_invalid_cases(client):
+    response = client.post('/api/evaluate', query_string={'name': 'first', 'stream': '1'},
+                           json=[[{"a": 1}], ["Answer 0"]])
+    lines = [line for line in response.get_data(True).splitlines() if line]
+    assert len(lines) == 2
+
+
+def test_jobs_are_read_from_disk(client):
+    job = app.UploadJob('upload.zip')
+    job.update('parsing', 0.6)
+
+    response = client.get(f'/api/jobs/{job.id}')
+    assert response.status_code == 200
+    assert response.get_json()['stage'] == 'parsing'
+    assert os.path.exists(os.path.join(app.JOBS_FOLDER, f"{job.id}.json"))
+    assert client.get(f'/api/jobs/{"0" * 32}').status_code == 404
+    assert client.get('/api/jobs/..%2F..%2Fetc').status_code == 404
+
+
+def upload_archive(client, name, **query):
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zip_file:
+        zip_file.writestr(f"{name}/{name}.xml", map_xml(NODES, EDGES))
+    archive.seek(0)
+    return client.post('/api/load_tree', query_string=query, data={'file': (archive, f"{name}.zip")},
+                       content_type='multipart/form-data')
+
+
+def test_async_upload_is_streamed_to_the_staging_folder(client):
+    import ingest
+
+    response = upload_archive(client, 'third', **{'async': '1'})
+    assert response.status_code == 202
+    for _ in range(100):
+        job = client.get(response.headers['Location']).get_json()
+        if job['stage'] in ('done', 'failed'):
+            break
+        time.sleep(0.05)
+
+    assert job['stage'] == 'done', job['error']
+    assert client.get('/api/get_children', query_string={'name': 'third', 'node': 'A'}).status_code == 200
+    assert os.listdir(ingest.UPLOADS_FOLDER) == []
+
+
+def test_async_upload_over_the_limit_is_rejected(client, monkeypatch):
+    import ingest
+
+    monkeypatch.setattr(ingest, 'MAX_ARCHIVE_BYTES', 100)
+    response = upload_archive(client, 'third', **{'async': '1'})
+
+    assert response.status_code == 413
+    assert os.listdir(ingest.UPLOADS_FOLDER) == []
+    assert not os.path.exists(app.JOBS_FOLDER) or os.listdir(app.JOBS_FOLDER) == []
+
+
+def test_image_variants_keep_the_original_hash(client, tmp_path, monkeypatch):
+    from PIL import Image
+
+    monkeypatch.setattr(app.app, 'root_path', str(tmp_path))
+
+    os.makedirs(os.path.join('first', 'images'))
+    image = os.path.join('first', 'images', 'picture.png')
+    Image.new('RGB', (200, 100), (10, 20, 30)).save(image)
+    client.get('/api/tree', query_string={'name': 'first'})
+    content_hash = app.get_tree_assets('first').get(image)
+
+    response = client.get('/api/images', query_string={'image': image, 'w': 64, 'v': content_hash},
+                          headers={'Accept': 'image/webp'})
+
+    assert response.status_code == 200
+    assert response.mimetype == 'image/webp'
+    assert response.headers['Cache-Control'] == app.IMMUTABLE_CACHE_CONTROL
+    assert response.get_etag()[0] == f"{content_hash}-w64-webp"
+
+
+def test_search_index_is_loaded_on_first_search(client):
+    client.get('/api/tree', query_string={'name': 'first'})
+    assert app.tree_registry.peek('first').search_index is None
+    assert not os.path.exists(os.path.join('first', app.SEARCH_INDEX_FILE))
+
+    response = client.get('/api/search', query_string={'name': 'first', 'q': 'left'})
+
+    assert [result['id'] for result in response.get_json()] == ['B']
+    assert os.path.exists(os.path.join('first', app.SEARCH_INDEX_FILE))
+
+
+def test_images_outside_tree_image_folders_are_not_served(client, tmp_path, monkeypatch):
+    from PIL import Image
+
+    monkeypatch.setattr(app.app, 'root_path', str(tmp_path))
+    os.makedirs('elsewhere')
+    Image.new('RGB', (200, 100)).save(os.path.join('elsewhere', 'picture.png'))
+    Image.new('RGB', (200, 100)).save(os.path.join('first', 'picture.png'))
+
+    for image in ('elsewhere/picture.png', 'first/picture.png', 'first/images/../picture.png'):
+        response = client.get('/api/images', query_string={'image': image, 'w': 64})
+        assert response.status_code == 404
+    assert not os.path.exists(os.path.join('elsewhere', app.VARIANTS_FOLDER))
+    assert not os.path.exists(os.path.join('first', app.VARIANTS_FOLDER))
+
+
+def test_replaced_image_gets_new_variants(client, tmp_path, monkeypatch):
+    from PIL import Image
+
+    monkeypatch.setattr(app.app, 'root_path', str(tmp_path))
+    os.makedirs(os.path.join('first', 'images'))
+    image = os.path.join('first', 'images', 'picture.png')
+    Image.new('RGB', (200, 100), (255, 0, 0)).save(image)
+    first = client.get('/api/images', query_string={'image': image, 'w': 64})
+
+    Image.new('RGB', (200, 100), (0, 0, 255)).save(image)
+    second = client.get('/api/images', query_string={'image': image, 'w': 64})
+
+    assert second.status_code == 200
+    assert second.get_data() != first.get_data()
+
+
+def test_description_cache_reads_replaced_files(tmp_path):
+    cache = app.DescriptionCache()
+    path = tmp_path / 'text.txt'
+    path.write_text("Old text")
+    assert cache.get(str(path)) == "Old text"
+
+    path.write_text("New text")
+    mtime = path.stat().st_mtime_ns + 10 ** 9
+    os.utime(path, ns=(mtime, mtime))
+    assert cache.get(str(path)) == "New text"
+
+
+def test_catalog_sees_a_tree_uploaded_again_by_another_worker(client):
+    catalog = app.TreeCatalog(refresh_seconds=3600)
+    with open(os.path.join('first', 'description.txt'), 'w') as file:
+        file.write("Old description")
+    assert [entry['description'] for entry in catalog.list('first')] == ["Old description"]
+
+    old = {path: os.stat(path).st_mtime_ns for path in ('first', os.path.join('first', 'description.txt'))}
+    os.rename('first', 'deleted')
+    os.makedirs('first')
+    with open(os.path.join('first', 'description.txt'), 'w') as file:
+        file.write("New description")
+    for path, mtime in sorted(old.items(), reverse=True):
+        os.utime(path, ns=(mtime, mtime))
+    os.utime('.', ns=(old['first'] + 1, old['first'] + 1))
+
+    assert [entry['description'] for entry in catalog.list('first')] == ["New description"]
+
+
+def counter(name, **labels):
+    return app.metrics._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+
+def test_get_children_is_cached_and_revalidated(client):
+    query = {'name': 'first', 'node': 'A'}
+    first = client.get('/api/get_children', query_string=query)
+    hits = counter('response_cache_requests_total', result='hit')
+
+    second = client.get('/api/get_children', query_string=query)
+    revalidated = client.get('/api/get_children', query_string=query, headers={'If-None-Match': first.get_etag()[0]})
+
+    assert second.get_data() == first.get_data()
+    assert second.get_etag() == first.get_etag()
+    assert counter('response_cache_requests_total', result='hit') == hits + 2
+    assert revalidated.status_code == 304
+    assert revalidated.get_data() == b''
+
+
+def test_get_children_fetches_several_nodes_and_subtrees(client):
+    batch = client.get('/api/get_children', query_string={'name': 'first', 'node': 'B,C'}).get_json()
+    assert sorted(batch['entities']) == ['B', 'C']
+    assert batch['children'] == {'B': [], 'C': []}
+
+    subtree = client.get('/api/get_children', query_string={'name': 'first', 'node': 'A', 'depth': 2,
+                                                            'known': 'A'}).get_json()
+    assert sorted(subtree['entities']) == ['B', 'C']
+    assert subtree['children']['A'] == [['L0', 'B'], ['L1', 'C']]
+    assert sorted(subtree['links']) == ['L0', 'L1']
+    assert subtree['truncated'] is False
+
+    missing = client.get('/api/get_children', query_string={'name': 'first', 'node': 'A,Z'})
+    assert missing.status_code == 404
+
+
+def test_trees_lists_folders_and_notices_new_ones(client):
+    with open(os.path.join('first', 'description.txt'), 'w') as file:
+        file.write("First tree\n")
+    response = client.get('/api/trees')
+    assert response.headers['X-Total-Count'] == '2'
+    assert {tree['name']: tree['description'] for tree in response.get_json()} == {
+        'first': "First tree", 'second': "No description available"}
+
+    os.makedirs('third')
+    assert [tree['name'] for tree in client.get('/api/trees').get_json()] == ['first', 'second', 'third']
+    assert [tree['name'] for tree in client.get('/api/trees', query_string={'q': 'SEC'}).get_json()] == ['second']
+
+
+def test_streamed_ascii_matches_the_json_rendering(client):
+    query = {'name': 'first'}
+    rendered = client.get('/api/tree_ascii', query_string=query).get_json()['tree_ascii']
+    streamed = client.get('/api/tree_ascii', query_string={**query, 'stream': '1'})
+
+    assert streamed.mimetype == 'text/plain'
+    assert streamed.get_data(True) == rendered
+    assert rendered.splitlines()[0] == "└── [1] Root? [A]"
+
+
+def test_validate_reports_cycles_without_loading(client):
+    with open(os.path.join('first', 'first.xml'), 'w') as file:
+        file.write(map_xml(NODES, EDGES + [('C', 'A')]))
+
+    report = client.get('/api/tree/validate', query_string={'name': 'first'}).get_json()
+
+    assert report['valid'] is False
+    assert report['cycles']
+    assert app.tree_registry.peek('first') is None
+
+
+def test_warm_up_loads_recent_trees_with_their_roots_encoded(client, monkeypatch):
+    client.get('/api/tree', query_string={'name': 'second'})
+    client.get('/api/tree', query_string={'name': 'first'})
+    assert app.read_recent_trees()[:2] == ['first', 'second']
+
+    monkeypatch.setattr(app, 'tree_registry', app.TreeRegistry())
+    assert app.warm_up_trees() == ['first', 'second']
+
+    for name in ('first', 'second'):
+        store = app.tree_registry.peek(name)
+        assert (store.root_id, False) in store.response_cache
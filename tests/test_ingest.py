@@ -0,0 +1,101 @@
+"""
+Archive checks of the upload ingestion.
+"""
+import io
+
+import pytest
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+import ingest
+
+LISTING = """
+UNRAR 6.24 freeware      Copyright (c) 1993-2023 Alexander Roshal
+
+Archive: upload.rar
+Details: RAR 5
+
+        Name: tree/images
+        Type: Directory
+  Attributes: drwxr-xr-x
+
+        Name: tree/tree.xml
+        Type: File
+        Size: 2048
+ Packed size: 512
+       Ratio: 25%
+
+        Name: tree/images/picture.png
+        Type: File
+        Size: 4096
+ Packed size: 4000
+       Ratio: 97%
+"""
+
+
+SEVEN_ZIP_LISTING = """
+7-Zip 23.01 (x64) : Copyright (c) 1999-2023 Igor Pavlov : 2023-06-20
+
+Listing archive: upload.rar
+
+--
+Path = upload.rar
+Type = Rar5
+Physical Size = 4600
+
+----------
+Path = tree/images
+Folder = +
+Size = 0
+
+Path = tree/tree.xml
+Folder = -
+Size = 2048
+Packed Size = 512
+
+Path = tree/images/picture.png
+Folder = -
+Size = 4096
+Packed Size = 4000
+"""
+LSAR_LISTING = ('{"lsarContents": [{"XADFileName": "tree/images", "XADIsDirectory": 1}, '
+                '{"XADFileName": "tree/tree.xml", "XADFileSize": 2048}, '
+                '{"XADFileName": "tree/images/picture.png", "XADFileSize": 4096}]}')
+BSDTAR_LISTING = """drwxr-xr-x  0 0      0           0 Oct 17 01:13 tree/images/
+-rw-r--r--  0 0      0        2048 Oct 17 01:13 tree/tree.xml
+-rw-r--r--  0 0      0        4096 Oct 17 01:13 tree/images/a picture.png
+"""
+
+
+@pytest.mark.parametrize('parse, listing', [
+    (ingest.parse_unrar_listing, LISTING),
+    (ingest.parse_7z_listing, SEVEN_ZIP_LISTING),
+    (ingest.parse_lsar_listing, LSAR_LISTING),
+    (ingest.parse_bsdtar_listing, BSDTAR_LISTING),
+], ids=['unrar', '7z', 'lsar', 'bsdtar'])
+def test_rar_listings_give_file_sizes(parse, listing):
+    assert parse(listing) == [2048, 4096]
+
+
+def test_unrar_free_listing_is_not_trusted():
+    assert ingest.parse_unrar_listing(LISTING.replace('Alexander Roshal', 'unrar-free')) == []
+
+
+def test_rar_uploads_without_a_lister_are_unsupported(monkeypatch):
+    monkeypatch.setattr(ingest.shutil, 'which', lambda program: None)
+    with pytest.raises(UnsupportedMediaType):
+        ingest.list_rar_sizes('upload.rar')
+
+
+def test_rar_limits_are_checked_before_extraction(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, 'MAX_ARCHIVE_BYTES', 5000)
+    monkeypatch.setattr(ingest, 'list_rar_sizes', lambda path: ingest.parse_unrar_listing(LISTING))
+    monkeypatch.setattr(ingest.patoolib, 'extract_archive', pytest.fail)
+
+    class Staging:
+        scratch = str(tmp_path)
+
+    class Upload:
+        stream = io.BytesIO(b'Rar!')
+
+    with pytest.raises(RequestEntityTooLarge):
+        ingest._extract_from_rar(Upload, Staging, [])
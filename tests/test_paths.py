@@ -0,0 +1,52 @@
+"""
+Root-to-node path enumeration for /api/get_path.
+"""
+import time
+
+import app
+from helpers import map_xml
+
+
+def ladder(tmp_path, depth):
+    """
+    Builds a DAG of `depth` rungs with two nodes each, both joined to both
+    nodes of the rung above, so END has 2 ** depth paths.
+    """
+    nodes = {'R': "Root?", 'END': "End"}
+    edges, above = [], ['R']
+    for rung in range(depth):
+        current = [f"N{rung}a", f"N{rung}b"]
+        nodes.update((node_id, node_id) for node_id in current)
+        edges.extend((parent, child) for child in current for parent in above)
+        above = current
+    edges.extend((parent, 'END') for parent in above)
+    path = tmp_path / 'ladder.xml'
+    path.write_text(map_xml(nodes, edges))
+    store = app.EntityStore()
+    store.parse_xtm_file(str(path))
+    store.build_decision_tree()
+    return store
+
+
+def test_first_path_does_not_enumerate_all_paths(tmp_path):
+    store = ladder(tmp_path, 30)
+    started = time.perf_counter()
+    paths, truncated = app.find_paths_to_node(store, 'END', limit=1)
+    assert time.perf_counter() - started < 1
+    assert truncated
+    assert len(paths) == 1 and len(paths[0]) == 32
+
+
+def test_all_paths_shortest_first(tmp_path):
+    store = ladder(tmp_path, 4)
+    paths, truncated = app.find_paths_to_node(store, 'END', limit=None)
+    assert not truncated
+    assert len(paths) == 16
+    assert len({tuple(node['id'] for node in path) for path in paths}) == 16
+    assert all(path[0]['id'] == 'R' and path[-1]['id'] == 'END' for path in paths)
+
+
+def test_max_depth_skips_paths_that_are_too_long(tmp_path):
+    store = ladder(tmp_path, 4)
+    assert list(app.iter_paths_to_node(store, 'END', max_depth=4)) == []
+    assert len(list(app.iter_paths_to_node(store, 'END', max_depth=5))) == 16
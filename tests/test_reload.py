@@ -0,0 +1,222 @@
+"""
+Reloading a resident tree after its XTM file was edited: incremental
+reparses of valid edits, and rejected edits that keep the previous tree in
+service without being parsed again on every check.
+"""
+import os
+
+import pytest
+
+import app
+from helpers import TOPIC, map_xml
+
+NODES = {'A': "Root?", 'B': "Left?", 'C': "Right?", 'D': "Leaf"}
+EDGES = [('A', 'B'), ('A', 'C'), ('B', 'D')]
+XML_PATH = os.path.join('tree', 'tree.xml')
+
+
+def write_map(nodes=NODES, edges=EDGES):
+    save(map_xml(nodes, edges))
+
+
+def save(text):
+    # Every save gets a distinct, later mtime, however fast the test runs.
+    mtime = os.stat(XML_PATH).st_mtime_ns + 10 ** 9 if os.path.exists(XML_PATH) else None
+    with open(XML_PATH, 'w') as file:
+        file.write(text)
+    if mtime is not None:
+        os.utime(XML_PATH, ns=(mtime, mtime))
+
+
+def counter(name, **labels):
+    return app.metrics._counters.get((name, tuple(sorted(labels.items()))), 0)
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app, 'GENERATION_CHECK_SECONDS', 0)
+    os.makedirs('tree')
+    write_map()
+    return app.TreeRegistry()
+
+
+def test_edit_reloads_incrementally(registry):
+    store = registry.get('tree')
+    incremental = counter('tree_loads_total', source='incremental')
+
+    write_map(nodes={**NODES, 'D': "Edited leaf"})
+    reloaded = registry.get('tree')
+
+    assert reloaded is not store
+    assert reloaded.entities['D'].label == "Edited leaf"
+    assert counter('tree_loads_total', source='incremental') == incremental + 1
+    assert registry.get('tree') is reloaded
+
+
+@pytest.mark.parametrize('edges, nodes', [
+    (EDGES + [('D', 'A')], NODES),
+    (EDGES + [('B', 'MISSING')], NODES),
+], ids=['cycle', 'dangling_reference'])
+def test_rejected_edit_keeps_previous_tree_until_file_changes(registry, edges, nodes):
+    store = registry.get('tree')
+    reloads = counter('tree_reloads_total')
+
+    write_map(nodes, edges)
+    for _ in range(5):
+        assert registry.get('tree') is store
+    assert counter('tree_reloads_total') == reloads + 1
+
+    write_map(nodes={**NODES, 'D': "Fixed leaf"})
+    reloaded = registry.get('tree')
+    assert reloaded is not store
+    assert reloaded.entities['D'].label == "Fixed leaf"
+
+
+def test_malformed_association_keeps_previous_tree(registry):
+    store = registry.get('tree')
+    reloads = counter('tree_reloads_total')
+    with open(XML_PATH) as file:
+        text = file.read()
+
+    save(text.replace('<instanceOf><topicRef xlink:type="simple" xlink:href="#L2"/></instanceOf>', ''))
+    for _ in range(5):
+        assert registry.get('tree') is store
+    assert counter('tree_reloads_total') == reloads + 1
+
+
+def test_truncated_file_keeps_previous_tree(registry):
+    store = registry.get('tree')
+    snapshot_path = os.path.join('tree', app.SNAPSHOT_FILE)
+    with open(snapshot_path, 'rb') as file:
+        snapshot = file.read()
+    with open(XML_PATH) as file:
+        text = file.read()
+    incremental = counter('tree_loads_total', source='incremental')
+    reloads = counter('tree_reloads_total')
+
+    save(text[:text.rindex('<association')] + '<association id="assoc_L2"><instanceOf>')
+    for _ in range(5):
+        assert registry.get('tree') is store
+    assert sorted(store.decision_tree['B'].values()) == ['D']
+    assert counter('tree_loads_total', source='incremental') == incremental
+    assert counter('tree_reloads_total') == reloads + 1
+    with open(snapshot_path, 'rb') as file:
+        assert file.read() == snapshot
+
+
+def test_scan_rejects_content_outside_elements(tmp_path):
+    path = tmp_path / 'map.xml'
+    complete = ('<?xml version="1.0" encoding="UTF-8"?>\n<topicMap xmlns="http://www.topicmaps.org/xtm/1.0/">\n'
+                + TOPIC.format(id='A', kind='concept', label="Root?") + '</topicMap>\n')
+    path.write_text(complete)
+    assert len(app.TreeSources.scan(str(path))) == 1
+
+    for broken in (complete.replace('</topicMap>', ''), complete.replace('\n<topic', '\n<junk/><topic'),
+                   complete[:complete.index('</topic>')]):
+        path.write_text(broken)
+        assert app.TreeSources.scan(str(path)) is None
+
+
+def test_scan_across_chunks_matches_whole_file(registry, monkeypatch):
+    elements = app.TreeSources.scan(XML_PATH, known={})
+    monkeypatch.setattr(app.TreeSources, 'CHUNK_SIZE', 256)
+
+    assert app.TreeSources.scan(XML_PATH, known={}) == elements
+    assert [source for _, _, source in app.TreeSources.scan(XML_PATH)] == [None] * len(elements)
+
+
+def test_image_variant_does_not_reload_tree(registry):
+    from PIL import Image
+
+    os.makedirs(os.path.join('tree', 'images'))
+    image_path = os.path.join('tree', 'images', 'picture.png')
+    Image.new('RGB', (200, 100), (10, 20, 30)).save(image_path)
+    store = registry.get('tree')
+
+    variant_path, _ = app.select_image_variant(image_path, 64, True)
+
+    assert os.path.exists(variant_path)
+    assert os.path.dirname(variant_path) == os.path.join('tree', 'images', app.VARIANTS_FOLDER)
+    assert registry.get('tree') is store
+
+
+def test_compressed_assets_do_not_reload_tree(registry):
+    os.makedirs(os.path.join('tree', 'images'))
+    with open(os.path.join('tree', 'images', 'diagram.svg'), 'w') as file:
+        file.write('<svg xmlns="http://www.w3.org/2000/svg"/>')
+    reloads = counter('tree_reloads_total')
+
+    store = registry.get('tree')
+
+    assert os.path.exists(os.path.join('tree', 'images', app.VARIANTS_FOLDER, 'diagram.svg.gz'))
+    assert registry.get('tree') is store
+    assert counter('tree_reloads_total') == reloads
+
+
+def test_asset_index_only_reads_changed_files(registry):
+    os.makedirs(os.path.join('tree', 'images'))
+    path = os.path.join('tree', 'images', 'diagram.svg')
+    with open(path, 'w') as file:
+        file.write('<svg id="a"/>')
+    content_hash = app.AssetIndex.build('tree').get(path)
+
+    stat = os.stat(path)
+    with open(path, 'w') as file:
+        file.write('<svg id="b"/>')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert app.AssetIndex.build('tree').get(path) == content_hash
+
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert app.AssetIndex.build('tree').get(path) != content_hash
+
+
+def fresh_parse():
+    store = app.EntityStore()
+    store.parse_xtm_file(XML_PATH)
+    store.build_decision_tree()
+    return store
+
+
+def test_artifact_matches_a_fresh_parse(registry):
+    write_map(edges=EDGES + [('C', 'D')])
+    registry.get('tree')
+    attached = counter('tree_loads_total', source='artifact')
+
+    store = app.TreeRegistry().get('tree')
+    parsed = fresh_parse()
+
+    assert counter('tree_loads_total', source='artifact') == attached + 1
+    assert store.root_id == parsed.root_id == 'A'
+    for node_id in NODES:
+        assert app.create_node(store, node_id) == app.create_node(parsed, node_id)
+        assert app.find_paths_to_node(store, node_id) == app.find_paths_to_node(parsed, node_id)
+
+
+def test_stale_or_damaged_artifact_is_not_attached(registry):
+    snapshot_path = os.path.join('tree', app.SNAPSHOT_FILE)
+    store = registry.get('tree')
+    assert app.EntityStore.load_snapshot(snapshot_path, store.source_mtime) is not None
+
+    write_map(nodes={**NODES, 'D': "Edited leaf"})
+    source_mtime = app.tree_source_mtime('tree', XML_PATH)
+    assert app.EntityStore.load_snapshot(snapshot_path, source_mtime) is None
+
+    with open(snapshot_path, 'r+b') as file:
+        file.truncate(64)
+    assert app.EntityStore.load_snapshot(snapshot_path, store.source_mtime) is None
+    parsed = counter('tree_loads_total', source='xml')
+    assert app.TreeRegistry().get('tree').entities['D'].label == "Edited leaf"
+    assert counter('tree_loads_total', source='xml') == parsed + 1
+
+
+@pytest.mark.parametrize('edges, message', [
+    (EDGES + [('D', 'A')], "Circular reference detected"),
+    (EDGES + [('B', 'MISSING')], "references missing topics: MISSING"),
+], ids=['cycle', 'dangling_reference'])
+def test_invalid_tree_reports_its_errors(registry, edges, message):
+    write_map(edges=edges)
+    with pytest.raises(app.TreeValidationError, match=message) as error:
+        fresh_parse()
+    assert error.value.report['valid'] is False
+    assert error.value.report['cycles' if 'Circular' in message else 'dangling']